@@ -0,0 +1,263 @@
+'''
+Tick-throughput benchmarks for the game's hot paths.
+
+Builds scenarios through the game's own classes at
+several plant counts and times three phases
+separately:
+
+    * update:    Game.step driven by scripted input
+    * collision: Person.adjust_deltas probes against the
+                 belt and every plant
+    * draw:      Game.draw onto an offscreen surface
+
+Usage:
+
+        python3 benchmark.py
+        python3 benchmark.py --plants 10 100 --ticks 200
+        python3 benchmark.py --compare old_results.json
+'''
+import os
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import argparse, json, math, platform, random, time, tracemalloc
+
+import numpy, pygame
+
+from main import Game, KeyState, NO_KEYS, plant_pool, preload_assets,\
+    WIDTH, HEIGHT, PERSON_SPEED, ConveyorBeltTray, Plant, PlantWaterTable,\
+    Sprite
+
+SCENARIO_SIZES = (10, 100, 1000, 10000)
+# Entities of each kind built to average their size over
+ENTITY_COUNT = 2000
+PHASES = ('update', 'collision', 'draw')
+DEFAULT_OUTPUT = 'benchmark_results.json'
+
+# Area of the floor that extra plants are set down on
+FIELD_TOP = 60
+FIELD_BOTTOM = 250
+
+def build_scenario(num_plants, seed=0):
+    '''
+    Game with num_plants plants: the one the conveyor
+    belt spawns on the first tick, plus the rest set
+    down in a grid on the floor.
+    '''
+    game = Game(seed)
+    game.step(NO_KEYS)
+
+    extra = num_plants - len(game.plants)
+    if extra > 0:
+        columns = max(1, int(math.sqrt(extra * WIDTH / (FIELD_BOTTOM - FIELD_TOP))))
+        rows = math.ceil(extra / columns)
+        for i in range(extra):
+            x = (i % columns) * (WIDTH - 25) // columns
+            y = FIELD_TOP + (i // columns) * (FIELD_BOTTOM - FIELD_TOP) // rows
+            game.add_plant(plant_pool.acquire(x, y, game.water_table))
+
+    return game
+
+def get_inputs(ticks, seed=0):
+    '''
+    Scripted key states: walk in random directions
+    while holding shift to water, with occasional
+    presses of space.
+    '''
+    rng = random.Random(seed)
+    directions = (pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP, pygame.K_DOWN)
+
+    inputs = []
+    while len(inputs) < ticks:
+        held = {rng.choice(directions), pygame.K_LSHIFT}
+        duration = rng.randint(5, 30)
+        inputs.append(KeyState(held | {pygame.K_SPACE}))
+        inputs.extend([KeyState(held)] * (duration - 1))
+
+    return inputs[:ticks]
+
+def run_update(game, inputs):
+    for key in inputs:
+        start = time.perf_counter()
+        game.step(key)
+        yield time.perf_counter() - start
+
+def run_collision(game, ticks):
+    person = game.person
+    probes = ((PERSON_SPEED, 0), (-PERSON_SPEED, 0),\
+        (0, PERSON_SPEED), (0, -PERSON_SPEED))
+    for _ in range(ticks):
+        start = time.perf_counter()
+        for dx, dy in probes:
+            person.adjust_deltas(dx, dy, True, game.obstacles, game.semi_obstacles)
+        yield time.perf_counter() - start
+
+def run_draw(game, screen, ticks):
+    for _ in range(ticks):
+        start = time.perf_counter()
+        screen.fill((255, 255, 255))
+        game.draw(screen)
+        yield time.perf_counter() - start
+
+def get_phase_runner(phase, game, screen, ticks):
+    if phase == 'update':
+        return run_update(game, get_inputs(ticks))
+    elif phase == 'collision':
+        return run_collision(game, ticks)
+
+    return run_draw(game, screen, ticks)
+
+def get_percentile(samples, percent):
+    '''
+    Nearest-rank percentile of sorted samples
+    '''
+    i = max(0, math.ceil(percent / 100 * len(samples)) - 1)
+    return samples[i]
+
+def summarize(samples):
+    samples = sorted(samples)
+    total = sum(samples)
+    return {
+        'ticks': len(samples),
+        'ticks_per_second': len(samples) / total if total > 0 else None,
+        'p50_ms': get_percentile(samples, 50) * 1000,
+        'p95_ms': get_percentile(samples, 95) * 1000,
+        'p99_ms': get_percentile(samples, 99) * 1000,
+        'max_ms': samples[-1] * 1000,
+    }
+
+def measure_peak_memory(phase, num_plants, screen, ticks):
+    '''
+    Peak bytes allocated while running a phase on a
+    fresh scenario, not counting building it.
+    '''
+    game = build_scenario(num_plants)
+    tracemalloc.start()
+    try:
+        for _ in get_phase_runner(phase, game, screen, ticks):
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        game.release()
+
+    return peak
+
+def measure_entity_memory(count=ENTITY_COUNT):
+    '''
+    Bytes allocated per entity of each kind, averaged
+    over count of them. A plant's share includes its
+    container and its row of water table columns.
+    '''
+    kinds = (
+        ('plant', lambda table: Plant(0, 0, table)),
+        ('tray', lambda table: ConveyorBeltTray(0, 0)),
+        ('sprite', lambda table: Sprite('assets/x.png', 0, 0)),
+    )
+
+    sizes = {}
+    for kind, build in kinds:
+        entities = [None] * count
+        tracemalloc.start()
+        try:
+            table = PlantWaterTable(count)
+            for i in range(count):
+                entities[i] = build(table)
+            sizes[kind] = tracemalloc.get_traced_memory()[0] / count
+        finally:
+            tracemalloc.stop()
+
+    return sizes
+
+def run_benchmarks(sizes, ticks, memory_ticks):
+    screen = pygame.display.get_surface()
+    results = []
+    for num_plants in sizes:
+        scenario = {'plants': num_plants}
+        for phase in PHASES:
+            game = build_scenario(num_plants)
+            samples = list(get_phase_runner(phase, game, screen, ticks))
+            game.release()
+
+            scenario[phase] = summarize(samples)
+            scenario[phase]['peak_memory_bytes'] =\
+                measure_peak_memory(phase, num_plants, screen, memory_ticks)
+
+        results.append(scenario)
+        print_scenario(scenario)
+
+    return results
+
+def print_scenario(scenario):
+    for phase in PHASES:
+        stats = scenario[phase]
+        print('{:>6} plants  {:<9}  {:>10.1f} ticks/s  p50 {:>8.3f} ms  '
+            'p99 {:>8.3f} ms  peak {:>8.1f} KiB'.format(\
+            scenario['plants'], phase, stats['ticks_per_second'],\
+            stats['p50_ms'], stats['p99_ms'], stats['peak_memory_bytes'] / 1024))
+
+def compare(old_path, results):
+    '''
+    Print the change in ticks per second of each
+    phase against an earlier results file.
+    '''
+    with open(old_path) as f:
+        old = {s['plants']: s for s in json.load(f)['scenarios']}
+
+    for scenario in results:
+        previous = old.get(scenario['plants'])
+        if previous is None:
+            continue
+
+        for phase in PHASES:
+            before = previous[phase]['ticks_per_second']
+            after = scenario[phase]['ticks_per_second']
+            print('{:>6} plants  {:<9}  {:>+7.1f}%'.format(\
+                scenario['plants'], phase, (after / before - 1) * 100))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--plants', type=int, nargs='+', default=SCENARIO_SIZES,
+        help='plant counts to build scenarios with')
+    parser.add_argument('--ticks', type=int, default=300,
+        help='timed ticks per phase')
+    parser.add_argument('--memory-ticks', type=int, default=20,
+        help='ticks per phase traced for peak memory')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT,
+        help='where to write the results as JSON')
+    parser.add_argument('--compare', metavar='PATH',
+        help='earlier results file to compare against')
+    parser.add_argument('--entities', action='store_true',
+        help='only report the memory used per entity')
+    args = parser.parse_args()
+
+    pygame.init()
+    pygame.display.set_mode((WIDTH, HEIGHT))
+    preload_assets()
+
+    entity_memory = measure_entity_memory()
+    for kind, size in entity_memory.items():
+        print('{:>8}  {:>8.0f} bytes per entity'.format(kind, size))
+
+    if args.entities:
+        return
+
+    results = run_benchmarks(args.plants, args.ticks, args.memory_ticks)
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'pygame': pygame.version.ver,
+            'numpy': numpy.__version__,
+            'machine': platform.machine(),
+            'ticks': args.ticks,
+            'bytes_per_entity': entity_memory,
+            'scenarios': results,
+        }, f, indent=2)
+
+    if args.compare is not None:
+        compare(args.compare, results)
+
+if __name__ == '__main__':
+    main()
@@ -1,73 +1,577 @@
-import pygame, numpy, random
+import time
+
+# When this module started loading, for the startup report
+import_started = time.perf_counter()
+
+import pygame, numpy, random, os, heapq, struct
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from itertools import product
 
 WIDTH = 400
 HEIGHT = 300
+WORLD_WIDTH = WIDTH
+WORLD_HEIGHT = HEIGHT
 TRAY_WIDTH = 40
 TRAY_SPEED = 1
-NUM_TRAYS = 11
+# Belts with floor below them stop this far short of the left
+# edge of the world, leaving the person room to cross them
+BELT_CROSSING = 3 * TRAY_WIDTH
 PERSON_SPEED = 3
 PLANT_BUFFER = 5
 PLANT_PLACEMENT_BUFFER = 5
 BOTTOM_EDGE_BUFFER = 5
+SPAWN_INTERVAL = 1000
+# Simulation ticks per second of play, whatever the frame rate
+TICK_RATE = 60
+# Ticks run to catch up in one frame before the game slows down instead
+MAX_TICKS_PER_FRAME = 5
+# Frame rate cap, or 0 for none
+MAX_FPS = 240
+MAX_CYCLES_WITHOUT_WATER = 1500
+# Bounds of the water a plant loses per cycle, in thousandths
+WATER_DECAY_RANGE = (4, 8)
+# Water decay is rounded to a multiple of 1 / DECAY_SCALE, so
+# taking it off a water level is exact, and many cycles of
+# decay can be worked out at once with the same result
+DECAY_SCALE = 2 ** 20
+RECORDING_MAGIC = b'GGRC'
+RECORDING_VERSION = 3
+SNAPSHOT_MAGIC = b'GGSN'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_ALIGN = 64
 BACKGROUND = (255, 255, 255)
+SPATIAL_CELL_SIZE = 40
+CULL_MARGIN = 25
+ASSET_DIR = 'assets'
+# Decoded images and the font path, rebuilt whenever an asset changes
+ASSET_BUNDLE = 'assets.bundle'
+ASSET_BUNDLE_MAGIC = b'GGAB'
+ASSET_BUNDLE_VERSION = 1
+
+# Assets whose mirror image is used for a facing direction
+FLIPPED_ASSETS = (
+    'assets/person3_right.png',
+    'assets/water_left.png',
+    'assets/watering_can.png',
+)
+
+FONT_NAME = 'Courier'
+TEXT_CACHE_SIZE = 256
+
+# Frames averaged by the profiler overlay, how often
+# it is redrawn, and its distance from the corner
+PROFILE_WINDOW = 60
+PROFILE_REFRESH = 15
+PROFILE_MARGIN = 5
+
+# Autopilot: side of a path planning cell, spacing
+# of the slots it sets plants down in, and the
+# fractions of a full plant it waters from and to
+PATH_CELL = 10
+SLOT_SPACING = (70, 60)
+WATER_BELOW = 0.5
+WATER_UNTIL = 0.9
+# Ticks before a plant is predicted to die that the
+# autopilot drops everything to water it
+THIRST_TICKS = 1000
+# Ticks the autopilot stays put or presses space in
+# vain before it wanders off in a random direction
+STUCK_TICKS = 8
+# Occupancy grids the autopilot keeps, for when the
+# same one comes back, and goals it keeps the paths
+# to on each
+PATH_GRIDS = 4
+PATH_TREES = 32
+
+image_cache = {}
+facing_image_cache = {}
+font_cache = {}
+font_path_cache = {}
+text_cache = OrderedDict()
+
+def load_image(path, flip=False):
+    '''
+    Load an image at most once per process and hand
+    out the shared surface, mirrored horizontally if
+    flip is set. Never draw onto the result.
+    '''
+    key = (path, flip)
+    image = image_cache.get(key)
+    if image is None:
+        if flip:
+            image = pygame.transform.flip(load_image(path), True, False)
+        else:
+            image = pygame.image.load(path)
+            if pygame.display.get_surface() is not None:
+                image = image.convert_alpha()
+
+        image_cache[key] = image
+
+    return image
+
+def get_facing_images(back, right, front, left):
+    '''
+    Shared tuple of a sprite's image for each facing,
+    indexed by Sprite.NORTH, EAST, SOUTH and WEST.
+    Each argument is a path, or a (path, flip) pair
+    for a mirrored image.
+    '''
+    key = (back, right, front, left)
+    images = facing_image_cache.get(key)
+    if images is None:
+        images = tuple(load_image(*k) if isinstance(k, tuple) else load_image(k)\
+            for k in key)
+        facing_image_cache[key] = images
+
+    return images
+
+def facing_image(direction):
+    '''
+    Property exposing a sprite's image for one
+    facing as a plain attribute.
+    '''
+    def getter(sprite):
+        return sprite.images[direction]
+
+    def setter(sprite, image):
+        images = list(sprite.images)
+        images[direction] = image
+        sprite.images = tuple(images)
+
+    return property(getter, setter)
+
+def get_font(size):
+    '''
+    Shared game font at the given size, created
+    on first use.
+    '''
+    font = font_cache.get(size)
+    if font is None:
+        font = pygame.font.Font(get_font_path(), size)
+        font_cache[size] = font
+
+    return font
+
+def get_font_path():
+    '''
+    Path of the game font, or None for pygame's
+    default font. Finding it scans the system's
+    fonts, so it is done at most once per process,
+    and the asset bundle carries it between them.
+    '''
+    if FONT_NAME not in font_path_cache:
+        font_path_cache[FONT_NAME] = pygame.font.match_font(FONT_NAME)
+
+    return font_path_cache[FONT_NAME]
+
+def render_text(text, color, size, background=None):
+    '''
+    Render text in the game font, reusing the surface
+    from an earlier call with the same arguments.
+    Once TEXT_CACHE_SIZE surfaces are cached, the
+    least recently used one is dropped. Never draw
+    onto the result.
+    '''
+    key = (text, color, size, background)
+    image = text_cache.get(key)
+    if image is None:
+        image = get_font(size).render(text, True, color, background)
+        text_cache[key] = image
+        if len(text_cache) > TEXT_CACHE_SIZE:
+            text_cache.popitem(last=False)
+    else:
+        text_cache.move_to_end(key)
+
+    return image
+
+# Magic, version, image count and length of the font path
+ASSET_BUNDLE_HEADER = struct.Struct('<4sBII')
+# Length of the name, mtime and size of the PNG, width and height
+ASSET_BUNDLE_IMAGE = struct.Struct('<HqqHH')
+
+def preload_assets():
+    '''
+    Load and convert every image in the asset
+    directory, plus the mirrored facing variants,
+    so sprites never touch the disk during play.
+    Call once the display mode has been set.
+
+    Images are read from the asset bundle in a
+    single read when it is up to date, and the
+    bundle is rebuilt from the PNGs otherwise.
+    '''
+    image_cache.clear()
+    facing_image_cache.clear()
+    names = sorted(name for name in os.listdir(ASSET_DIR) if name.endswith('.png'))
+    stamps = get_asset_stamps(names)
+
+    bundle = load_asset_bundle(names, stamps)
+    if bundle is None:
+        images = [pygame.image.load('{}/{}'.format(ASSET_DIR, name))\
+            for name in names]
+        try:
+            save_asset_bundle(names, stamps, images, get_font_path())
+        except OSError:
+            # Without a bundle we just decode the PNGs every time
+            pass
+    else:
+        images, font_path = bundle
+        if font_path is None or os.path.exists(font_path):
+            font_path_cache[FONT_NAME] = font_path
+
+    convert = pygame.display.get_surface() is not None
+    for name, image in zip(names, images):
+        image_cache[('{}/{}'.format(ASSET_DIR, name), False)] =\
+            image.convert_alpha() if convert else image
+
+    [load_image(path, True) for path in FLIPPED_ASSETS]
+
+def get_asset_stamps(names):
+    '''
+    Modification time and size of each named PNG,
+    which tell whether the bundle is out of date
+    '''
+    stamps = []
+    for name in names:
+        stat = os.stat('{}/{}'.format(ASSET_DIR, name))
+        stamps.append((stat.st_mtime_ns, stat.st_size))
+
+    return stamps
+
+def save_asset_bundle(names, stamps, images, font_path):
+    '''
+    Pack images, decoded to RGBA, and the font
+    path into the asset bundle
+    '''
+    font = (font_path or '').encode()
+    with open(ASSET_BUNDLE, 'wb') as f:
+        f.write(ASSET_BUNDLE_HEADER.pack(ASSET_BUNDLE_MAGIC,\
+            ASSET_BUNDLE_VERSION, len(names), len(font)))
+        f.write(font)
+        for name, (mtime, size), image in zip(names, stamps, images):
+            encoded = name.encode()
+            f.write(ASSET_BUNDLE_IMAGE.pack(len(encoded), mtime, size,\
+                *image.get_size()))
+            f.write(encoded)
+            f.write(pygame.image.tobytes(image, 'RGBA'))
+
+def load_asset_bundle(names, stamps):
+    '''
+    Images and font path from the asset bundle,
+    or None if it is missing or out of date. The
+    images share the memory of the file's contents.
+    '''
+    try:
+        with open(ASSET_BUNDLE, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    view = memoryview(data)
+    try:
+        magic, version, count, font_size = ASSET_BUNDLE_HEADER.unpack_from(data)
+        if magic != ASSET_BUNDLE_MAGIC or version != ASSET_BUNDLE_VERSION or\
+            count != len(names):
+            return None
+
+        offset = ASSET_BUNDLE_HEADER.size
+        font_path = data[offset:offset + font_size].decode() or None
+        offset += font_size
+
+        images = []
+        for name, stamp in zip(names, stamps):
+            name_size, mtime, size, width, height =\
+                ASSET_BUNDLE_IMAGE.unpack_from(data, offset)
+            offset += ASSET_BUNDLE_IMAGE.size
+            if data[offset:offset + name_size].decode() != name or\
+                (mtime, size) != stamp:
+                return None
+
+            offset += name_size
+            pixels = view[offset:offset + 4 * width * height]
+            images.append(pygame.image.frombuffer(pixels, (width, height), 'RGBA'))
+            offset += len(pixels)
+    except (struct.error, ValueError):
+        # Truncated or corrupt; it is only a cache
+        return None
+
+    return images, font_path
+
+class SpatialHash:
+    '''
+    Uniform grid broadphase for collision queries.
+    Sprites are bucketed by the cells their bounding
+    rect covers, and re-bucketed whenever they move,
+    so a query only looks at sprites in nearby cells.
+    '''
+    def __init__(self, cell_size=SPATIAL_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.sprite_cells = {}
+        self.order = {}
+        self.next_order = 0
+
+    def __len__(self):
+        return len(self.sprite_cells)
+
+    def __iter__(self):
+        return iter(self.sprite_cells)
+
+    def get_cell_keys(self, rect):
+        size = self.cell_size
+        return tuple(product(range(rect.left // size, (rect.right - 1) // size + 1),\
+            range(rect.top // size, (rect.bottom - 1) // size + 1)))
+
+    def add(self, sprite, order=None):
+        '''
+        Start tracking a sprite. The sprite keeps
+        a reference to us so moves update its cells.
+        Queries return sprites sorted by order, which
+        defaults to the order they were added in.
+        '''
+        if sprite in self.sprite_cells:
+            return
+
+        if order is None:
+            order = self.next_order
+            self.next_order += 1
+
+        self.order[sprite] = order
+        self.sprite_cells[sprite] = ()
+        sprite.spatial_index = self
+        self.update(sprite)
+
+    def add_many(self, sprites):
+        '''
+        Start tracking many sprites in one pass, in
+        the order add() would have given them
+        '''
+        for sprite in sprites:
+            if sprite in self.sprite_cells:
+                continue
+
+            self.order[sprite] = self.next_order
+            self.next_order += 1
+            keys = self.get_cell_keys(sprite.get_rect())
+            for key in keys:
+                self.cells.setdefault(key, set()).add(sprite)
+            self.sprite_cells[sprite] = keys
+            sprite.spatial_index = self
+
+    def remove(self, sprite):
+        for key in self.sprite_cells.pop(sprite, ()):
+            self.cells[key].discard(sprite)
+        self.order.pop(sprite, None)
+        if sprite.spatial_index is self:
+            sprite.spatial_index = None
+
+    def update(self, sprite):
+        '''
+        Re-bucket a sprite after it has moved
+        '''
+        old_keys = self.sprite_cells[sprite]
+        new_keys = self.get_cell_keys(sprite.get_rect())
+        if new_keys == old_keys:
+            return
+
+        for key in old_keys:
+            self.cells[key].discard(sprite)
+        for key in new_keys:
+            self.cells.setdefault(key, set()).add(sprite)
+        self.sprite_cells[sprite] = new_keys
+
+    def query(self, rect):
+        '''
+        Return the sprites sharing a cell with rect,
+        sorted by their order.
+        '''
+        found = set()
+        for key in self.get_cell_keys(rect):
+            cell = self.cells.get(key)
+            if cell:
+                found |= cell
+
+        return sorted(found, key=self.order.__getitem__)
+
+def sweep_rect(rect, dx, dy, others):
+    '''
+    Return the furthest (dx, dy) that rect can move,
+    first along y and then along x, without
+    overlapping any rect in others.
+
+    Rects that already overlap rect are ignored,
+    so a sprite can always move out of them.
+    '''
+    if dy > 0:
+        for other in others:
+            if other.left < rect.right and rect.left < other.right and\
+                other.top >= rect.bottom:
+                dy = min(dy, other.top - rect.bottom)
+    elif dy < 0:
+        for other in others:
+            if other.left < rect.right and rect.left < other.right and\
+                other.bottom <= rect.top:
+                dy = max(dy, other.bottom - rect.top)
+
+    moved = rect.move(0, dy)
+    if dx > 0:
+        for other in others:
+            if other.top < moved.bottom and moved.top < other.bottom and\
+                other.left >= moved.right:
+                dx = min(dx, other.left - moved.right)
+    elif dx < 0:
+        for other in others:
+            if other.top < moved.bottom and moved.top < other.bottom and\
+                other.right <= moved.left:
+                dx = max(dx, other.right - moved.left)
+
+    return dx, dy
+
+def get_nearby(grounds, rect):
+    '''
+    If grounds can be queried by area, like a
+    SpatialHash or a ConveyorBelt, narrow it down to
+    the sprites near rect. Otherwise return it as is.
+    '''
+    if hasattr(grounds, 'query'):
+        return grounds.query(rect)
+
+    return grounds
 
-class Sprite(pygame.sprite.Sprite):
+class Sprite:
     '''
     Credit: https://docs.replit.com/tutorials/14-2d-platform-game
+
+    Sprites are slotted, and share their tuple of
+    facing images with every sprite that looks the
+    same, so large scenes stay small in memory.
+
+    A sprite with a holder only stores its offset
+    from the holder, so moving a sprite carries
+    everything it holds along without touching it.
+
+    Derived rects like the bottom edge are cached,
+    and updated in place the first time they are
+    asked for after the sprite, its holder or its
+    subsprites have moved.
     '''
+    __slots__ = ('image', 'images', 'own_rect', 'offset', 'facing',\
+        'subsprite', 'parent', 'spatial_index', 'immune_from_obstacles',\
+        'immune_from_semi_obstacles', 'bottom_edge', 'edge_stale')
 
     NORTH = 0
     EAST = 1
     SOUTH = 2
     WEST = 3
 
+    immune_permanently_from_obstacles = False
+
+    back_image = facing_image(NORTH)
+    right_image = facing_image(EAST)
+    front_image = facing_image(SOUTH)
+    left_image = facing_image(WEST)
+
     def __init__(self, image, startx, starty):
-        super().__init__()
+        self.images = get_facing_images(image, image, image, image)
+        self.image = self.images[Sprite.SOUTH]
+        self.own_rect = self.image.get_rect()
+        self.bottom_edge = None
 
-        self.image = pygame.image.load(image)
-        self.left_image = self.image
-        self.right_image = self.image
-        self.back_image = self.image
-        self.front_image = self.image
-        
-        self.facing = Sprite.SOUTH
+        Sprite.reset(self, startx, starty)
 
-        self.rect = self.image.get_rect()
+    def reset(self, startx, starty):
+        '''
+        Put a recycled sprite back in the state of
+        a newly built one at the given position.
+        '''
+        self.facing = Sprite.SOUTH
+        self.image = self.front_image
 
-        self.rect.bottomleft = [startx, starty]
+        # Let go of any old holder without moving
+        self.parent = None
+        self.offset = None
+        self.own_rect.size = self.image.get_size()
+        self.own_rect.bottomleft = [startx, starty]
+        self.invalidate()
 
         self.subsprite = None
-        self.holder = None
+        self.spatial_index = None
         self.immune_from_obstacles = True
         self.immune_from_semi_obstacles = True
 
-        self.immune_permanently_from_obstacles = False
+    @property
+    def rect(self):
+        '''
+        Our area of the world. A held sprite's is
+        worked out from its holder's when asked for.
+        '''
+        if self.parent is not None:
+            left, top = self.parent.rect.topleft
+            dx, dy = self.offset
+            self.own_rect.topleft = (left + dx, top + dy)
+
+        return self.own_rect
+
+    @property
+    def holder(self):
+        return self.parent
+
+    @holder.setter
+    def holder(self, holder):
+        '''
+        Start following holder, or stop following
+        when holder is None, staying where we are.
+        '''
+        rect = self.rect
+        self.parent = holder
+        self.offset = None
+        if holder is not None:
+            left, top = holder.rect.topleft
+            self.offset = (rect.left - left, rect.top - top)
     
     def change_direction(self, direction):
         if direction == self.facing:
             return
 
-        self.facing = direction
-        if self.facing == Sprite.NORTH:
-            self.image = self.back_image
-        elif self.facing == Sprite.SOUTH:
-            self.image = self.front_image
-        elif self.facing == Sprite.EAST:
-            self.image = self.right_image
-        elif self.facing == Sprite.WEST:
-            self.image = self.left_image
+        self.set_facing(direction)
 
         if self.subsprite is not None:
             self.subsprite.change_direction(direction)
             self.move_subsprite_to_front()
 
+    def set_facing(self, direction):
+        '''
+        Face a direction, leaving any subsprite as is
+        '''
+        self.facing = direction
+        self.image = self.images[direction]
+
     def move_subsprite_to_front(self):
         pass
 
+    def invalidate(self):
+        '''
+        Mark our cached rects out of date
+        '''
+        self.edge_stale = True
+
     def get_bottom_edge(self):
-        return pygame.Rect(self.rect.left,\
-            self.get_rect().bottom - BOTTOM_EDGE_BUFFER,\
-            self.get_rect().width, BOTTOM_EDGE_BUFFER)
+        if profiler.enabled:
+            profiler.count('rects_saved')
+
+        if self.edge_stale:
+            self.edge_stale = False
+            rect = self.get_rect()
+            edge = (rect.left, rect.bottom - BOTTOM_EDGE_BUFFER,\
+                rect.width, BOTTOM_EDGE_BUFFER)
+            if self.bottom_edge is None:
+                # Most sprites never need one
+                self.bottom_edge = pygame.Rect(edge)
+            else:
+                self.bottom_edge.update(edge)
+
+        return self.bottom_edge
     
     def get_rect(self):
         return self.rect
@@ -75,7 +579,7 @@ class Sprite(pygame.sprite.Sprite):
     def adjust_deltas(self, dx, dy, bounds=False, obstacles=None, semi_obstacles=None):
         '''
         If bounds is set to True, take the bounds
-        of the universe into account.
+        of the world into account.
         
         If obstacles is a sequence containing other
         sprites, do not collide with those sprites.
@@ -102,10 +606,10 @@ class Sprite(pygame.sprite.Sprite):
         
         if bounds:
             min_dx = max(-self.get_rect().left, dx)
-            max_dx = min(WIDTH - self.get_rect().right, dx)
+            max_dx = min(WORLD_WIDTH - self.get_rect().right, dx)
             
             min_dy = max(-self.get_rect().top, dy)
-            max_dy = min(HEIGHT - self.get_rect().bottom, dy)
+            max_dy = min(WORLD_HEIGHT - self.get_rect().bottom, dy)
 
             # Check bounds before moving
             if dx < min_dx:
@@ -119,18 +623,20 @@ class Sprite(pygame.sprite.Sprite):
                 dy = max_dy
     
         if len(obstacles) > 0:
-            while self.check_collision(0, dy, obstacles) and dy != 0:
-                dy -= numpy.sign(dy)
-                
-            while self.check_collision(dx, dy, obstacles):
-                dx -= numpy.sign(dx)
+            if profiler.enabled:
+                profiler.count('collision_queries')
+            swept = self.rect.union(self.rect.move(dx, dy))
+            dx, dy = sweep_rect(self.rect, dx, dy,\
+                [item.rect for item in get_nearby(obstacles, swept)])
         
         if len(semi_obstacles) > 0:
-            while self.check_semi_collision(0, dy, semi_obstacles) and dy != 0:
-                dy -= numpy.sign(dy)
-            
-            while self.check_semi_collision(dx, dy, semi_obstacles):
-                dx -= numpy.sign(dx)
+            if profiler.enabled:
+                profiler.count('collision_queries')
+            bottom_edge = self.get_bottom_edge()
+            swept = bottom_edge.union(bottom_edge.move(dx, dy))
+            dx, dy = sweep_rect(bottom_edge, dx, dy,\
+                [item.get_bottom_edge() for item in get_nearby(semi_obstacles, swept)\
+                    if item is not self and item is not self.subsprite])
 
         return dx, dy
     
@@ -151,42 +657,89 @@ class Sprite(pygame.sprite.Sprite):
             
             current_sprite = current_sprite.subsprite
 
+        self.shift(adx, ady)
+
+    def shift(self, dx, dy):
+        '''
+        Move this sprite and its subsprites without
+        checking bounds or collisions.
+        '''
+        # Subsprites follow through their offsets, but
+        # their cells in a spatial index still change
+        self.move_unsafe(dx, dy)
+
         current_sprite = self
-        while True:
-            current_sprite.move_unsafe(adx, ady)
+        while current_sprite is not None:
+            current_sprite.invalidate()
+            if current_sprite.spatial_index is not None:
+                current_sprite.spatial_index.update(current_sprite)
 
-            if current_sprite.subsprite is None:
-                break
-            
             current_sprite = current_sprite.subsprite
+
+        # Holders' bounds may include ours
+        current_sprite = self.parent
+        while current_sprite is not None:
+            current_sprite.invalidate()
+            current_sprite = current_sprite.parent
             
     def move_unsafe(self, dx, dy):
-        self.rect.move_ip([dx, dy])
+        if self.parent is None:
+            self.own_rect.move_ip([dx, dy])
+        else:
+            # Truncated the way Rect.move_ip() would
+            self.offset = (self.offset[0] + int(dx), self.offset[1] + int(dy))
 
     def update(self):
         pass
 
     def draw(self, screen):
-        screen.blit(self.image, self.rect)
+        screen.blits(self.get_blits(), False)
+
+    def get_blits(self):
+        '''
+        (surface, position) pairs that draw us,
+        in order, for Surface.blits()
+        '''
+        return [(self.image, self.rect.topleft)]
+
+    def get_draw_rect(self):
+        '''
+        Area of the world that draw() paints
+        '''
+        return self.rect
+
+    def get_draw_state(self):
+        '''
+        Everything that decides what draw() paints.
+        While it stays the same, our area of the
+        screen does not need repainting.
+        '''
+        return (self.image, self.rect.topleft)
     
     def check_collision(self, x, y, grounds):
         return len(self.get_collisions(x, y, grounds)) != 0
     
     def get_collisions(self, x, y, grounds):
-        self.rect.move_ip([x, y])
-        collisions = pygame.sprite.spritecollide(self, grounds, False)
-        self.rect.move_ip([-x, -y])
-        return collisions
+        rect = self.rect.move(x, y)
+        return [item for item in get_nearby(grounds, rect)\
+            if rect.colliderect(item.rect)]
     
     def check_semi_collision(self, x, y, grounds):
-        self.rect.move_ip([x, y])
+        '''
+        Check whether our bottom edge would overlap the
+        bottom edge of any item in grounds. We never
+        collide with ourselves or with what we carry.
+        '''
         retval = False
-        for item in grounds:
-            if self.get_bottom_edge().colliderect(item.get_bottom_edge()):
+        bottom_edge = self.get_bottom_edge().move(x, y)
+        for item in get_nearby(grounds, bottom_edge):
+            if item is self or item is self.subsprite:
+                continue
+
+            if bottom_edge.colliderect(item.get_bottom_edge()):
                 retval = True
                 break
         
-        self.rect.move_ip([-x, -y])
         return retval
     
     def set_immune_from_obstacles(self, value):
@@ -198,6 +751,7 @@ class Person(Sprite):
     '''
     Represent the game's primary actor.
     '''
+    __slots__ = ('speed', 'hands_free')
 
     def __init__(self, startx, starty):
         '''
@@ -208,27 +762,31 @@ class Person(Sprite):
 
         self.immune_from_semi_obstacles = False
 
-        self.front_image = self.image
-        self.back_image = pygame.image.load("assets/person3_back.png")
-        self.left_image = pygame.image.load("assets/person3_right.png")
-        self.left_image = pygame.transform.flip(self.left_image, True, False)
-        self.right_image = pygame.image.load("assets/person3_right.png")
+        self.images = get_facing_images("assets/person3_back.png",\
+            "assets/person3_right.png", "assets/person3_front.png",\
+            ("assets/person3_right.png", True))
 
         self.speed = PERSON_SPEED
         self.hands_free = True
 
-    def update(self, plants, obstacles, watering_can):
+    def update(self, plants, obstacles, watering_can, key=None, semi_obstacles=None):
         '''
         Listen for key presses and respond by:
             * moving
             * picking up / setting down plant
             * TODO: picking up / setting down water
+
+        If key is None, read the live keyboard state.
+        Semi_obstacles may be a SpatialHash holding the
+        plants and watering can; by default it is built
+        from plants and watering_can.
         '''
         super().update()
 
         dx = 0
         dy = 0
-        key = pygame.key.get_pressed()
+        if key is None:
+            key = pygame.key.get_pressed()
         if key[pygame.K_LEFT]:
             dx = -self.speed
             self.change_direction(Sprite.WEST)
@@ -242,11 +800,14 @@ class Person(Sprite):
             dy = self.speed
             self.change_direction(Sprite.SOUTH)
 
+        if semi_obstacles is None:
+            semi_obstacles = plants + [watering_can]
+
         if key[pygame.K_SPACE]:
             if self.hands_free:
                 self.hands_free = False
                 if self.subsprite is None:
-                    self.pickup_nearby_object(plants + [watering_can])
+                    self.pickup_nearby_object(semi_obstacles)
                 else:
                     self.place_object()
         else:
@@ -258,7 +819,6 @@ class Person(Sprite):
             else:
                 self.subsprite.stop_watering()
         
-        semi_obstacles = [i for i in plants + [watering_can] if i != self.subsprite]
         self.move(dx, dy, True, obstacles, semi_obstacles)
     
     def get_one_step_deltas(self):
@@ -352,120 +912,555 @@ class Person(Sprite):
         self.subsprite.move(0, extra_buffer)
 
 class Container(Sprite):
+    __slots__ = ()
+
     def __init__(self, startx, starty):
         super().__init__("assets/pot.png", startx, starty)
 
+class PlantWaterTable:
+    '''
+    Water state for many plants, stored as one
+    NumPy column per field so that every plant
+    can be updated with a single batched kernel.
+    Row i belongs to plants[i].
+
+    The table also keeps a heap of predicted deaths,
+    counted in table ticks, so that idle stretches
+    can be skipped up to the next one. Stale
+    predictions are dropped from it once they
+    outnumber the rows, so it stays bounded.
+
+    If index is set to a SpatialHash holding every
+    plant in the table, watering only looks at the
+    plants near the spray.
+    '''
+    COLUMNS = (
+        ('water_level', numpy.float64),
+        ('max_water_level', numpy.float64),
+        ('water_decay', numpy.float64),
+        ('overwater_amount', numpy.float64),
+        ('overwater_limit', numpy.float64),
+        ('cycles_without_water', numpy.int64),
+        ('max_cycles_without_water', numpy.int64),
+        ('alive', numpy.bool_),
+        ('underwatered', numpy.bool_),
+        ('overwatered', numpy.bool_),
+    )
+
+    def __init__(self, capacity=16, rng=None):
+        self.rng = rng if rng is not None else random
+        self.size = 0
+        self.tick = 0
+        self.plants = []
+        self.versions = []
+        self.events = []
+        self.index = None
+        for name, dtype in PlantWaterTable.COLUMNS:
+            setattr(self, name, numpy.zeros(capacity, dtype=dtype))
+
+    def add(self, plant, roll=True):
+        '''
+        Give the plant a new row with freshly
+        rolled water parameters. Return the row.
+
+        If roll is False, the row is left for the
+        caller to fill in and reschedule.
+        '''
+        if self.size == len(self.water_level):
+            self.grow(2 * self.size)
+
+        row = self.size
+        self.size += 1
+        self.plants.append(plant)
+        self.versions.append(0)
+        if not roll:
+            return row
+
+        self.alive[row] = True
+        self.underwatered[row] = False
+        self.overwatered[row] = False
+
+        self.cycles_without_water[row] = 0
+        self.max_cycles_without_water[row] = MAX_CYCLES_WITHOUT_WATER
+
+        self.max_water_level[row] = float(self.rng.randint(10, 20))
+        self.water_level[row] = self.max_water_level[row]
+        self.water_decay[row] = round(self.rng.randint(*WATER_DECAY_RANGE) /\
+            1000 * DECAY_SCALE) / DECAY_SCALE
+
+        self.overwater_amount[row] = 0.0
+        self.overwater_limit[row] = self.max_water_level[row] * 0.5
+
+        self.schedule(row)
+
+        return row
+
+    def extend(self, plants, columns):
+        '''
+        Give many plants new rows at once, filled in
+        from columns, which maps each column's name to
+        its values for the plants, in order. The rows
+        are left for the caller to reschedule.
+        '''
+        start = self.size
+        stop = start + len(plants)
+        if stop > len(self.water_level):
+            self.grow(max(stop, 2 * start))
+
+        self.size = stop
+        for name, _ in PlantWaterTable.COLUMNS:
+            getattr(self, name)[start:stop] = columns[name]
+
+        for row, plant in enumerate(plants, start):
+            plant.row = row
+        self.plants.extend(plants)
+        self.versions.extend([0] * len(plants))
+
+    def remove(self, row):
+        '''
+        Drop a row by moving the last row into its
+        place. Return the plant whose row changed,
+        or None.
+        '''
+        last = self.size - 1
+        moved = None
+        if row != last:
+            for name, _ in PlantWaterTable.COLUMNS:
+                column = getattr(self, name)
+                column[row] = column[last]
+
+            moved = self.plants[last]
+            moved.row = row
+            self.plants[row] = moved
+            self.versions[row] = self.versions[last]
+
+        self.plants.pop()
+        self.versions.pop()
+        self.size -= 1
+
+        # Forget the removed row's predictions and
+        # renumber the moved row's
+        self.events = [(death_tick, row if r == last else r, version)\
+            for death_tick, r, version in self.events if r != row]
+        self.compact_events()
+
+        return moved
+
+    def grow(self, capacity):
+        for name, dtype in PlantWaterTable.COLUMNS:
+            column = numpy.zeros(capacity, dtype=dtype)
+            column[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, column)
+
+    def update(self, water_spray, rows=None):
+        '''
+        Apply one tick of watering, decay, overwatering
+        and underwatering to the given slice of rows
+        (all rows by default).
+        '''
+        if rows is None:
+            rows = slice(0, self.size)
+
+        water_level = self.water_level[rows]
+        max_water_level = self.max_water_level[rows]
+        water_decay = self.water_decay[rows]
+        overwater_amount = self.overwater_amount[rows]
+        cycles_without_water = self.cycles_without_water[rows]
+
+        watered = []
+        if water_spray is not None:
+            watered = self.get_watered(water_spray.get_rect(), rows)
+            water_level[watered] += 0.05
+
+        numpy.maximum(0.0, water_level - water_decay, out=water_level)
+
+        above_max = water_level > max_water_level
+        numpy.add(overwater_amount, water_decay,\
+            out=overwater_amount, where=above_max)
+
+        recovering = ~above_max & (overwater_amount > 0.0)
+        numpy.subtract(overwater_amount,\
+            numpy.minimum(water_decay * 0.25, overwater_amount),\
+            out=overwater_amount, where=recovering)
+
+        overwatered = overwater_amount +\
+            (water_level - max_water_level) >\
+            self.overwater_limit[rows]
+        self.overwatered[rows] |= overwatered
+
+        dry = water_level < 0.01
+        numpy.add(cycles_without_water, 1,\
+            out=cycles_without_water, where=dry)
+        underwatered = dry & (cycles_without_water >=\
+            self.max_cycles_without_water[rows])
+        self.underwatered[rows] |= underwatered
+
+        self.alive[rows] &= ~(overwatered | underwatered)
+
+        start, stop, _ = rows.indices(self.size)
+        if start == 0 and stop == self.size:
+            self.tick += 1
+            [self.schedule(row) for row in watered]
+        else:
+            # Rows updated on their own fall out of step
+            # with the table's tick count
+            [self.schedule(row) for row in range(start, stop)]
+
+    def advance(self, ticks):
+        '''
+        Apply the given number of ticks at once, as if
+        no plant were watered in that time. Decay is
+        exact (see DECAY_SCALE), so the result is the
+        same as ticking one at a time.
+        '''
+        self.tick += ticks
+        n = self.size
+        if n == 0 or ticks <= 0:
+            return
+
+        water_level = self.water_level[:n]
+        max_water_level = self.max_water_level[:n]
+        water_decay = self.water_decay[:n]
+        overwater_amount = self.overwater_amount[:n]
+        cycles_without_water = self.cycles_without_water[:n]
+
+        # Rows that lose no water are kept out of the
+        # divisions: their level never moves, so they stay
+        # above the maximum or dry for every tick, or never
+        decays = water_decay > 0.0
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            # Ticks that end above the maximum add to the
+            # overwater amount; the rest let it recover
+            above_ticks = numpy.where(decays, numpy.clip(get_last_above(\
+                water_level, max_water_level, water_decay), 0, ticks),\
+                numpy.where(water_level > max_water_level, ticks, 0))
+            first_dry = numpy.where(decays | (water_level < 0.01),\
+                get_first_dry(water_level, water_decay), ticks + 1)
+
+        overwater_amount += above_ticks * water_decay
+        numpy.maximum(0.0, overwater_amount -\
+            (ticks - above_ticks) * water_decay * 0.25, out=overwater_amount)
+
+        dry_ticks = numpy.clip(ticks - first_dry + 1, 0, ticks).astype(numpy.int64)
+
+        numpy.maximum(0.0, water_level - ticks * water_decay, out=water_level)
+        cycles_without_water += dry_ticks
+
+        underwatered = (dry_ticks > 0) &\
+            (cycles_without_water >= self.max_cycles_without_water[:n])
+        self.underwatered[:n] |= underwatered
+        self.alive[:n] &= ~underwatered
+
+    def schedule(self, row):
+        '''
+        Forget any earlier prediction for a row and
+        push a fresh one.
+        '''
+        self.versions[row] += 1
+        death_tick = self.predict_death(row)
+        if death_tick is not None:
+            heapq.heappush(self.events, (death_tick, row, self.versions[row]))
+
+            # Watering reschedules a row every tick, and
+            # only the top of the heap is ever popped
+            if len(self.events) > 2 * self.size + 64:
+                self.compact_events()
+
+    def compact_events(self):
+        '''
+        Drop stale predictions and rebuild the heap
+        '''
+        versions = self.versions
+        self.events = [event for event in self.events\
+            if event[2] == versions[event[1]]]
+        heapq.heapify(self.events)
+
+    def get_watered(self, spray_rect, rows):
+        '''
+        Positions within the slice rows of the plants
+        that spray_rect touches, in row order
+        '''
+        if self.index is None:
+            return spray_rect.collidelistall(\
+                [p.get_rect() for p in self.plants[rows]])
+
+        start, stop, _ = rows.indices(self.size)
+        return sorted(p.row - start for p in self.index.query(spray_rect)\
+            if isinstance(p, Plant) and p.water_table is self and\
+            start <= p.row < stop and spray_rect.colliderect(p.get_rect()))
+
+    def predict_deaths(self, rows=None):
+        '''
+        Predict what predict_death() would for each of
+        rows, all rows by default, working them all
+        out at once. Returns the death ticks and a mask
+        of the rows that die at all.
+        '''
+        if rows is None:
+            rows = slice(0, self.size)
+
+        water_level = self.water_level[rows]
+        water_decay = self.water_decay[rows]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            first_dry = get_first_dry(water_level, water_decay)
+        remaining = numpy.maximum(self.max_cycles_without_water[rows] -\
+            self.cycles_without_water[rows], 1)
+        death_ticks = self.tick + first_dry + remaining - 1
+        dies = self.alive[rows] & ((water_level < 0.01) | (water_decay > 0.0))
+
+        return death_ticks, dies
+
+    def reschedule(self):
+        '''
+        Replace every prediction with a fresh one,
+        working them all out at once, after the
+        columns have been overwritten wholesale
+        '''
+        death_ticks, dies = self.predict_deaths()
+
+        self.versions = [version + 1 for version in self.versions]
+        self.events = [(int(death_ticks[row]), row, self.versions[row])\
+            for row in numpy.flatnonzero(dies).tolist()]
+        heapq.heapify(self.events)
+
+    def predict_death(self, row):
+        '''
+        Table tick after which the plant in row dies
+        if it is never watered again, or None if
+        it never does.
+
+        Only underwatering needs predicting: while the
+        water level is above the maximum, decay moves
+        as much into the overwater amount as it takes
+        off the level, and below it the overwater
+        amount only shrinks. So without watering,
+        the overwater limit is never newly crossed.
+        '''
+        if not self.alive[row]:
+            return None
+
+        water_level = float(self.water_level[row])
+        water_decay = float(self.water_decay[row])
+        if water_level < 0.01:
+            first_dry = 1
+        elif water_decay <= 0.0:
+            return None
+        else:
+            first_dry = int(get_first_dry(water_level, water_decay))
+
+        remaining = int(self.max_cycles_without_water[row]) -\
+            int(self.cycles_without_water[row])
+        return self.tick + first_dry + max(remaining, 1) - 1
+
+    def get_next_death(self):
+        '''
+        Earliest predicted death tick of a live plant,
+        or None. Stale predictions are dropped here.
+        '''
+        while len(self.events) > 0:
+            death_tick, row, version = self.events[0]
+            if version == self.versions[row] and self.alive[row]:
+                return death_tick
+
+            heapq.heappop(self.events)
+
+        return None
+
+    def get_dead_plant(self):
+        '''
+        Return the first plant that is no longer
+        alive, or None.
+        '''
+        dead = numpy.flatnonzero(~self.alive[:self.size])
+        if len(dead) == 0:
+            return None
+
+        return self.plants[dead[0]]
+
+def get_first_dry(water_level, water_decay):
+    '''
+    First tick, counting from 1, that leaves less
+    than 0.01 water, for undisturbed levels losing
+    water_decay per tick. Decay is exact, so the
+    estimate from dividing is checked against what
+    that many ticks of decay leave.
+    '''
+    first_dry = numpy.floor((water_level - 0.01) / water_decay) + 1
+    first_dry = first_dry + (water_level - first_dry * water_decay >= 0.01)
+    first_dry = first_dry - (water_level - (first_dry - 1) * water_decay < 0.01)
+    return numpy.where(water_level < 0.01, 1, first_dry)
+
+def get_last_above(water_level, max_water_level, water_decay):
+    '''
+    Last tick, counting from 1, that leaves more
+    than max_water_level water, for undisturbed
+    levels losing water_decay per tick; 0 or less
+    if there is none.
+    '''
+    last = numpy.ceil((water_level - max_water_level) / water_decay) - 1
+    last = last + (water_level - (last + 1) * water_decay > max_water_level)
+    return last - (water_level - last * water_decay <= max_water_level)
+
+def water_column(name, cast):
+    '''
+    Property exposing one PlantWaterTable column
+    as a plain attribute of a Plant.
+    '''
+    def getter(plant):
+        return cast(getattr(plant.water_table, name)[plant.row])
+
+    def setter(plant, value):
+        getattr(plant.water_table, name)[plant.row] = value
+        plant.water_table.schedule(plant.row)
+
+    return property(getter, setter)
+
 class Plant(Sprite):
     '''
     Composite object with a plant and a container.
+    Water state lives in a shared PlantWaterTable.
     '''
-    def __init__(self, startx, starty):
+    __slots__ = ('water_table', 'row', 'bounds', 'bounds_stale')
+
+    water_level = water_column('water_level', float)
+    max_water_level = water_column('max_water_level', float)
+    water_decay = water_column('water_decay', float)
+    overwater_amount = water_column('overwater_amount', float)
+    overwater_limit = water_column('overwater_limit', float)
+    cycles_without_water = water_column('cycles_without_water', int)
+    max_cycles_without_water = water_column('max_cycles_without_water', int)
+    alive = water_column('alive', bool)
+    underwatered = water_column('underwatered', bool)
+    overwatered = water_column('overwatered', bool)
+
+    def __init__(self, startx, starty, water_table=None, roll=True):
         super().__init__("assets/plant1.png", startx, starty)
-        self.subsprite = Container(startx, starty)
-        self.font = pygame.font.SysFont('Courier', 10)
-        
-        self.alive = True
-        self.underwatered = False
-        self.overwatered = False
+        self.bounds = pygame.Rect(0, 0, 0, 0)
+        self.pot(startx, starty, water_table, roll)
 
-        self.cycles_without_water = 0
-        self.max_cycles_without_water = 1500
-        
-        self.max_water_level = float(random.randint(10, 20))
-        self.water_level = self.max_water_level
-        self.water_decay = random.randint(4, 8) / 1000
+    def reset(self, startx, starty, water_table=None, roll=True):
+        super().reset(startx, starty)
+        self.pot(startx, starty, water_table, roll)
+
+    def pot(self, startx, starty, water_table, roll):
+        '''
+        Stand the plant in a container at the given
+        position, and give it a row in water_table
+        as PlantWaterTable.add() would. If roll is
+        None, the row is left to be given by
+        PlantWaterTable.extend() instead.
+        '''
+        self.subsprite = container_pool.acquire(startx, starty)
 
-        self.overwater_amount = 0.0
-        self.overwater_limit = self.max_water_level * 0.5
+        if water_table is None:
+            water_table = PlantWaterTable(1)
+        self.water_table = water_table
+        if roll is not None:
+            self.row = water_table.add(self, roll)
 
         self.rect.move_ip([
             self.rect.left - self.subsprite.rect.left,
             self.subsprite.rect.top - self.rect.bottom
         ])
+        self.subsprite.holder = self
+        self.invalidate()
+
+    def release(self):
+        '''
+        Hand this plant and its container back to
+        their pools. The plant must not be used
+        again until it is handed out by plant_pool.
+        '''
+        container_pool.release(self.subsprite)
+        self.subsprite = None
+        plant_pool.release(self)
     
+    def invalidate(self):
+        super().invalidate()
+        self.bounds_stale = True
+
     def get_rect(self):
-        new_left = min(self.rect.left, self.subsprite.rect.left)
-        new_right = max(self.rect.right, self.subsprite.rect.right)
-        new_top = min(self.rect.top, self.subsprite.rect.top)
-        new_bottom = max(self.rect.bottom, self.subsprite.rect.bottom)
+        '''
+        Bounds of the plant and its container
+        '''
+        if profiler.enabled:
+            profiler.count('rects_saved')
+
+        if self.bounds_stale:
+            self.bounds_stale = False
+            self.bounds.update(self.rect)
+            self.bounds.union_ip(self.subsprite.rect)
 
-        return pygame.Rect(new_left, new_top, new_right - new_left,\
-            new_bottom - new_top)
+        return self.bounds
 
     def get_bottom_edge(self):
         return self.subsprite.get_bottom_edge()
     
     def update(self, cycle, water_spray):
+        '''
+        Update this plant alone. Games update all
+        plants at once through PlantWaterTable.update.
+        '''
         super().update()
-
-        if water_spray is not None and\
-            self.get_rect().colliderect(water_spray.get_rect()):
-            self.water_level += 0.05
-
-        self.water_level = max(\
-            0.0, self.water_level - self.water_decay)
-
-        if self.water_level >\
-            self.max_water_level:
-            
-            self.overwater_amount += self.water_decay
-        
-        elif self.overwater_amount > 0.0:
-            self.overwater_amount -= min(self.water_decay * 0.25, self.overwater_amount)
-
-        if self.overwater_amount +\
-            (self.water_level - self.max_water_level) >\
-            self.overwater_limit:
-            
-            self.alive = False
-            self.overwatered = True
-        
-        if self.water_level < 0.01:
-            self.cycles_without_water += 1
-            if self.cycles_without_water >=\
-                self.max_cycles_without_water:
-                
-                self.alive = False
-                self.underwatered = True
+        self.water_table.update(water_spray, slice(self.row, self.row + 1))
     
-    def draw(self, screen):
-        super().draw(screen)
-        if self.subsprite is not None:
-            self.subsprite.draw(screen)
-        
+    def get_label(self):
+        '''
+        Rendered water label and where it goes
+        '''
         color = (0, 0, 0)
         if self.water_level < 0.1 or self.water_level > self.max_water_level:
             color = (255, 0, 0)
 
-        water_text = self.font.render('water: {}'.format(int(self.water_level)), True, color)
-        screen.blit(water_text, (self.rect.x, self.rect.y - water_text.get_rect().height))
+        water_text = render_text('water: {}'.format(int(self.water_level)), color, 10)
+        return water_text, (self.rect.x, self.rect.y - water_text.get_rect().height)
+
+    def get_blits(self):
+        blits = super().get_blits()
+        if self.subsprite is not None:
+            blits.extend(self.subsprite.get_blits())
+
+        blits.append(self.get_label())
+        return blits
+
+    def get_draw_rect(self):
+        water_text, position = self.get_label()
+        return self.get_rect().union(water_text.get_rect(topleft=position))
+
+    def get_draw_state(self):
+        return (super().get_draw_state(),\
+            self.subsprite.get_draw_state(), self.get_label())
 
 class WaterSpray(Sprite):
     '''
     Water coming out of watering can when
     watering can is being used
     '''
+    __slots__ = ()
+
+    immune_permanently_from_obstacles = True
+
     def __init__(self, startx, starty):
         super().__init__('assets/water_down.png', startx, starty)
 
-        self.front_image = self.image
-        self.back_image = pygame.image.load('assets/water_up.png')
-        self.left_image = pygame.image.load('assets/water_left.png')
-        self.right_image = pygame.transform.flip(self.left_image, True, False)
-
-        self.immune_permanently_from_obstacles = True
+        self.images = get_facing_images('assets/water_up.png',\
+            ('assets/water_left.png', True), 'assets/water_down.png',\
+            'assets/water_left.png')
 
 class WateringCan(Sprite):
     '''
     Watering can sprite used to water plants.
     '''
+    __slots__ = ()
+
     def __init__(self, startx, starty):
         super().__init__("assets/watering_can.png", startx, starty)
 
-        self.left_image = self.image
-        self.right_image = pygame.transform.flip(self.left_image, True, False)
-        self.back_image = pygame.image.load('assets/watering_can_back.png')
-        self.front_image = pygame.image.load('assets/watering_can_front.png')
+        # Until it is first turned, the can keeps
+        # the side view it was built with
+        self.images = get_facing_images('assets/watering_can_back.png',\
+            ('assets/watering_can.png', True), 'assets/watering_can_front.png',\
+            'assets/watering_can.png')
     
     def move_subsprite_to_front(self):
         super().move_subsprite_to_front()
@@ -494,78 +1489,1788 @@ class WateringCan(Sprite):
                 my_rect.centery - sub_rect.centery)
     
     def water(self):
-        self.subsprite = WaterSpray(0, 0)
+        self.stop_watering()
+        self.subsprite = spray_pool.acquire(0, 0)
+        self.subsprite.holder = self
         self.subsprite.change_direction(self.facing)
         self.move_subsprite_to_front()
 
     def stop_watering(self):
+        if self.subsprite is not None:
+            spray_pool.release(self.subsprite)
         self.subsprite = None
     
-    def draw(self, screen):
-        super().draw(screen)
+    def get_blits(self):
+        blits = super().get_blits()
+        if self.subsprite is not None:
+            blits.extend(self.subsprite.get_blits())
+
+        return blits
+
+    def get_draw_rect(self):
+        if self.subsprite is None:
+            return self.rect
+
+        return self.rect.union(self.subsprite.rect)
+
+    def get_draw_state(self):
+        spray_state = None
         if self.subsprite is not None:
-            self.subsprite.draw(screen)
+            spray_state = self.subsprite.get_draw_state()
+
+        return (super().get_draw_state(), spray_state)
 
 class ConveyorBeltTray(Sprite):
     '''
     Single tray on a conveyor belt that carries
     plants
     '''
+    __slots__ = ()
+
     def __init__(self, startx, starty):
         super().__init__("assets/tray1.png", startx, starty)
-    
-    def update(self):
-        '''
-        Move to the left. Move our plant
-        if we have one.
-        '''
-        super().update()
-        self.move(-TRAY_SPEED, 0)
 
 class ConveyorBelt:
     '''
     Constantly moving conveyor belt that can contain
-    plants
+    plants.
+
+    The trays form a fixed ring, one tray longer than
+    the belt, which runs from left to the right edge
+    of the world. Their positions follow directly
+    from the cycle count. Trays carrying a plant are
+    moved every cycle so the plant follows; the
+    others are only put in place when they are drawn
+    or a collision query reaches them.
     '''
-    def __init__(self):
+    def __init__(self, water_table=None, bottom=HEIGHT, left=0):
+        self.water_table = water_table
+        self.cycle = 0
+        self.left = left
+        self.num_trays = -(-(WORLD_WIDTH - left) // TRAY_WIDTH) + 1
         self.trays = []
-        for i in range(NUM_TRAYS):
-            self.trays.append(ConveyorBeltTray(i * TRAY_WIDTH, HEIGHT))
+        for i in range(self.num_trays):
+            self.trays.append(ConveyorBeltTray(left + i * TRAY_WIDTH, bottom))
+
+        self.top = self.trays[0].rect.top
+        self.bottom = self.trays[0].rect.bottom
+
+    def __len__(self):
+        return len(self.trays)
+
+    def get_tray_left(self, i):
+        '''
+        Left edge of tray i at the current cycle. Trays
+        wrap around to the right end once they are fully
+        past the left end of the belt.
+        '''
+        ring = self.num_trays * TRAY_WIDTH
+        return self.left - TRAY_WIDTH +\
+            (i * TRAY_WIDTH - self.cycle * TRAY_SPEED + TRAY_WIDTH) % ring
+
+    def place_tray(self, i):
+        '''
+        Put tray i where it belongs at the current
+        cycle, taking its plant along.
+        '''
+        tray = self.trays[i]
+        dx = self.get_tray_left(i) - tray.rect.left
+        if dx != 0:
+            tray.shift(dx, 0)
+
+        return tray
     
-    def update(self):
+    def update(self, cycles=1):
         '''
-        Update each tray in belt
+        Advance the belt by the given number of cycles
+        '''
+        self.cycle += cycles
+        for i, tray in enumerate(self.trays):
+            if tray.subsprite is not None:
+                self.place_tray(i)
+
+    def query(self, rect):
         '''
-        [tray.update() for tray in self.trays]
-        if self.trays[0].rect.right < 0:
-            self.trays[0].move(self.trays[-1].rect.right - self.trays[0].rect.left, 0)
-            self.trays = self.trays[1:] + [self.trays[0]]
+        Trays overlapping rect, worked out from the
+        cycle count rather than by searching.
+        '''
+        if rect.bottom <= self.top or rect.top >= self.bottom:
+            return []
+
+        left = max(rect.left, self.left - TRAY_WIDTH)
+        right = min(rect.right, self.left + (self.num_trays - 1) * TRAY_WIDTH)
+        if right <= left:
+            return []
+
+        # Slot j covers x in [j * TRAY_WIDTH - offset, ... + TRAY_WIDTH)
+        offset = self.cycle * TRAY_SPEED - self.left
+        first = (left + offset) // TRAY_WIDTH
+        last = (right - 1 + offset) // TRAY_WIDTH
+        slots = dict.fromkeys(j % self.num_trays for j in range(first, last + 1))
+
+        return [self.place_tray(i) for i in slots]
 
     def draw(self, screen):
         '''
         Draw each tray in belt
         '''
-        [tray.draw(screen) for tray in self.trays]
+        [tray.draw(screen) for tray in self.get_trays()]
     
     def add_plant(self):
         '''
         If the last tray is empty, add a plant to it
         '''
-        last_tray = self.trays[-1]
+        last = max(range(self.num_trays), key=self.get_tray_left)
+        last_tray = self.place_tray(last)
         
         # cannot add a new plant if the last
         # tray is already full
         if last_tray.subsprite is not None:
             return None
 
-        new_plant = Plant(last_tray.rect.left + PLANT_BUFFER, last_tray.rect.bottom - PLANT_BUFFER)
+        new_plant = plant_pool.acquire(last_tray.rect.left + PLANT_BUFFER,\
+            last_tray.rect.bottom - PLANT_BUFFER, self.water_table)
         last_tray.subsprite = new_plant
         new_plant.holder = last_tray
 
         return new_plant
     
     def get_trays(self):
-        return self.trays
+        return [self.place_tray(i) for i in range(self.num_trays)]
+
+class ConveyorBelts(list):
+    '''
+    The conveyor belts of a world, one along the
+    bottom of each window-height band, usable as a
+    single group of obstacles. Belts with floor
+    below them leave a crossing at the left edge.
+    '''
+    def __init__(self, water_table=None):
+        bottoms = [(i + 1) * HEIGHT for i in range(max(1, WORLD_HEIGHT // HEIGHT))]
+        super().__init__(ConveyorBelt(water_table, bottom,\
+            BELT_CROSSING if bottom < WORLD_HEIGHT else 0) for bottom in bottoms)
+
+    def update(self, cycles=1):
+        [belt.update(cycles) for belt in self]
+
+    def query(self, rect):
+        return [tray for belt in self for tray in belt.query(rect)]
+
+    def draw(self, screen):
+        [belt.draw(screen) for belt in self]
+
+    def add_plants(self):
+        '''
+        Add a plant to the end of each belt that has
+        room for one, and return the new plants.
+        '''
+        return [plant for plant in (belt.add_plant() for belt in self)\
+            if plant is not None]
+
+    def get_trays(self):
+        return [tray for belt in self for tray in belt.get_trays()]
+
+class Pool:
+    '''
+    Free list of reusable objects. acquire() resets and
+    returns a released object when there is one (a hit),
+    and builds a new one otherwise (a miss).
+    '''
+    def __init__(self, factory):
+        self.factory = factory
+        self.free = []
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, *args):
+        if len(self.free) > 0:
+            self.hits += 1
+            obj = self.free.pop()
+            obj.reset(*args)
+            return obj
+
+        self.misses += 1
+        return self.factory(*args)
+
+    def release(self, obj):
+        self.free.append(obj)
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'free': len(self.free)}
+
+spray_pool = Pool(WaterSpray)
+plant_pool = Pool(Plant)
+container_pool = Pool(Container)
+
+def get_pool_stats():
+    return {
+        'spray': spray_pool.get_stats(),
+        'plant': plant_pool.get_stats(),
+        'container': container_pool.get_stats(),
+    }
+
+class RenderQueue:
+    '''
+    Floating items kept sorted by the bottom of
+    their bounds, so that nearer items are drawn
+    over farther ones, and by the order they were
+    added in where bottoms are equal.
+
+    Most items never move once set down, so only
+    the items touch() is told about are re-keyed,
+    and only when the order is next needed.
+    '''
+    def __init__(self):
+        self.items = []
+        self.keys = []
+        self.item_keys = {}
+        self.order = {}
+        self.next_order = 0
+        self.moved = set()
+        self.tallest = 0
+
+    def get_key(self, item):
+        return (item.get_rect().bottom, self.order[item])
+
+    def add(self, item):
+        self.order[item] = self.next_order
+        self.next_order += 1
+        self.tallest = max(self.tallest, item.get_rect().height)
+        self.insert(item, self.get_key(item))
+
+    def add_many(self, items):
+        '''
+        Add many items, in order, with a single sort
+        rather than an insert for each
+        '''
+        for item in items:
+            self.order[item] = self.next_order
+            self.next_order += 1
+            self.tallest = max(self.tallest, item.get_rect().height)
+            self.item_keys[item] = self.get_key(item)
+
+        self.items = sorted(self.items + list(items), key=self.item_keys.__getitem__)
+        self.keys = [self.item_keys[item] for item in self.items]
+
+    def remove(self, item):
+        self.pop(item)
+        self.moved.discard(item)
+        del self.order[item]
+
+    def insert(self, item, key):
+        i = bisect_right(self.keys, key)
+        self.items.insert(i, item)
+        self.keys.insert(i, key)
+        self.item_keys[item] = key
+
+    def pop(self, item):
+        i = bisect_left(self.keys, self.item_keys.pop(item))
+        del self.items[i]
+        del self.keys[i]
+
+    def touch(self, items):
+        '''
+        Note that items may have moved since the
+        order was last restored. None is ignored.
+        '''
+        self.moved.update(items)
+        self.moved.discard(None)
+
+    def sort(self):
+        '''
+        Move every touched item to where it now belongs
+        '''
+        for item in self.moved:
+            key = self.get_key(item)
+            if key != self.item_keys[item]:
+                self.pop(item)
+                self.insert(item, key)
+
+        self.moved.clear()
+
+    def get_draw_order(self, person, area=None):
+        '''
+        Draw order of all our items, or of just those
+        that may overlap area, around the person.
+        Items are cut out of the order by their bottom
+        edge, from just below the top of area to as
+        low as the tallest item could reach it from,
+        and only checked one by one if area leaves
+        out part of the width of the world.
+        '''
+        self.sort()
+        if area is None:
+            return get_depth_order(person, self.items, self.keys)
+
+        start = bisect_left(self.keys, (area.top + 1,))
+        stop = bisect_left(self.keys, (area.bottom + self.tallest,))
+        items = self.items[start:stop]
+        keys = self.keys[start:stop]
+        if area.left > 0 or area.right < WORLD_WIDTH:
+            visible = [i for i, item in enumerate(items)\
+                if item.get_rect().colliderect(area)]
+            items = [items[i] for i in visible]
+            keys = [keys[i] for i in visible]
+
+        return get_depth_order(person, items, keys)
+
+def get_depth_order(person, items, keys):
+    '''
+    Given items sorted by their RenderQueue keys,
+    return the items behind the person, the person,
+    then items in front. Whatever the person holds is
+    drawn just in front of them when they face south
+    and just behind them otherwise.
+    '''
+    held = person.subsprite
+    split = bisect_left(keys, (person.get_rect().bottom,))
+
+    back_items = items[:split]
+    front_items = items[split:]
+    if held is not None:
+        if held in back_items:
+            back_items.remove(held)
+        elif held in front_items:
+            front_items.remove(held)
+
+    if held is None:
+        middle = [person]
+    elif person.facing == Sprite.SOUTH:
+        middle = [person, held]
+    else:
+        middle = [held, person]
+
+    return back_items + middle + front_items
+
+class KeyState:
+    '''
+    Snapshot of pressed keys, indexable like the
+    result of pygame.key.get_pressed(), so the
+    game can be driven without a keyboard.
+    '''
+    def __init__(self, pressed=()):
+        self.pressed = frozenset(pressed)
+
+    def __getitem__(self, key):
+        return key in self.pressed
+
+NO_KEYS = KeyState()
+
+class Game:
+    '''
+    Simulation state for a single game, kept
+    separate from any display surface. All
+    randomness comes from an RNG seeded with
+    seed, so a seed and the per-tick key states
+    reproduce a game exactly.
+
+    If max_plants is set, the oldest plants set
+    down on the floor are retired whenever there
+    are more, so long sessions do a bounded amount
+    of work per tick. Retired plants still count
+    towards the score, and their water state is
+    summed up in archive.
+    '''
+    def __init__(self, seed=None, max_plants=None):
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.seed = seed
+        self.rng = random.Random(seed)
+
+        self.person = Person(100, 200)
+        self.watering_can = WateringCan(300, 200)
+        self.plants = []
+        self.water_table = PlantWaterTable(rng=self.rng)
+        self.belts = ConveyorBelts(self.water_table)
+        self.faulting_plant = None
+        self.max_plants = max_plants
+        self.on_belt = set()
+        self.archive = {
+            'plants': 0,
+            'water_level': 0.0,
+            'overwater_amount': 0.0,
+            'cycles_without_water': 0,
+        }
+
+        self.obstacles = self.belts
+
+        # The watering can sorts after every plant, so
+        # pickups still prefer a plant over the can
+        self.semi_obstacles = SpatialHash()
+        self.semi_obstacles.add(self.watering_can, float('inf'))
+        self.water_table.index = self.semi_obstacles
+
+        self.render_queue = RenderQueue()
+        self.render_queue.add(self.watering_can)
+
+        self.cycle = 0
+
+    def step(self, key=None):
+        '''
+        Advance the simulation by one tick. If key
+        is None, read the live keyboard state.
+
+        Return the plant that ended the game, or
+        None if the game is still going.
+        '''
+        if self.faulting_plant is not None:
+            return self.faulting_plant
+
+        held = self.person.subsprite
+        self.person.update(self.plants, self.obstacles, self.watering_can,\
+            key, self.semi_obstacles)
+        # Plants can only leave the belt by being picked up
+        self.on_belt.discard(self.person.subsprite)
+        if profiler.enabled:
+            profiler.mark('person')
+
+        self.water_table.update(self.watering_can.subsprite)
+        if profiler.enabled:
+            profiler.mark('plants')
+
+        self.belts.update()
+        if profiler.enabled:
+            profiler.mark('belt')
+
+        # Only what was carried and what rides the belts
+        # can have moved; they are put back in depth
+        # order when the scene is next drawn
+        self.render_queue.touch((held, self.person.subsprite, self.watering_can))
+        self.render_queue.touch(self.on_belt)
+        if profiler.enabled:
+            profiler.mark('depth')
+
+        if self.cycle % SPAWN_INTERVAL == 0:
+            [self.add_plant(p) for p in self.belts.add_plants()]
+            if profiler.enabled:
+                profiler.mark('spawn')
+
+        if self.max_plants is not None and len(self.plants) > self.max_plants:
+            self.retire_plants(len(self.plants) - self.max_plants)
+            if profiler.enabled:
+                profiler.mark('retire')
+
+        self.faulting_plant = self.water_table.get_dead_plant()
+        if profiler.enabled:
+            profiler.mark('plants')
+
+        self.cycle += 1
+        return self.faulting_plant
+
+    def add_plant(self, plant):
+        '''
+        Start simulating, colliding with and drawing
+        a plant whose water state is in our table
+        '''
+        self.plants.append(plant)
+        self.semi_obstacles.add(plant)
+        self.render_queue.add(plant)
+        if isinstance(plant.holder, ConveyorBeltTray):
+            self.on_belt.add(plant)
+
+    def add_plants(self, plants):
+        '''
+        Add many plants as add_plant() would, filling
+        the index and render queue in one pass each
+        '''
+        self.plants.extend(plants)
+        self.semi_obstacles.add_many(plants)
+        self.render_queue.add_many(plants)
+        self.on_belt.update(plant for plant in plants\
+            if isinstance(plant.holder, ConveyorBeltTray))
+
+    def retire_plants(self, count):
+        '''
+        Retire up to count of the oldest live plants
+        that are set down on the floor
+        '''
+        retired = [p for p in self.plants if p.holder is None and p.alive][:count]
+        [self.retire_plant(p) for p in retired]
+
+    def retire_plant(self, plant):
+        '''
+        Stop simulating, colliding with and drawing a
+        plant, sum its water state into the archive
+        and hand it back to its pool.
+        '''
+        self.archive['plants'] += 1
+        self.archive['water_level'] += plant.water_level
+        self.archive['overwater_amount'] += plant.overwater_amount
+        self.archive['cycles_without_water'] += plant.cycles_without_water
+
+        self.plants.remove(plant)
+        self.semi_obstacles.remove(plant)
+        self.render_queue.remove(plant)
+        self.on_belt.discard(plant)
+        self.water_table.remove(plant.row)
+        plant.release()
+
+    def fast_forward(self, ticks):
+        '''
+        Advance up to the given number of ticks with
+        no keys pressed. Stretches where nothing happens
+        but water decay and belt motion are skipped in
+        one jump, up to the next plant spawn or the next
+        predicted plant death, which are stepped
+        normally. Stops early if the game ends.
+
+        A watering can set down while spraying keeps
+        spraying, so nothing is skipped while it does.
+        '''
+        end = self.cycle + ticks
+        while self.cycle < end and self.faulting_plant is None:
+            # A normal step first, so the person stops
+            # watering and settles before we skip
+            self.step(NO_KEYS)
+            if self.watering_can.subsprite is not None:
+                continue
+
+            next_event = min(end,\
+                -(-self.cycle // SPAWN_INTERVAL) * SPAWN_INTERVAL)
+
+            death_tick = self.water_table.get_next_death()
+            if death_tick is not None:
+                next_event = min(next_event,\
+                    self.cycle + death_tick - self.water_table.tick - 1)
+
+            if next_event > self.cycle and self.faulting_plant is None:
+                self.skip(next_event - self.cycle)
+
+        return self.faulting_plant
+
+    def skip(self, ticks):
+        '''
+        Jump ahead the given number of idle ticks
+        '''
+        self.belts.update(ticks)
+        self.water_table.advance(ticks)
+        self.render_queue.touch(self.on_belt)
+        self.faulting_plant = self.water_table.get_dead_plant()
+        self.cycle += ticks
+
+    def release(self):
+        '''
+        Hand this game's plants and water spray back to
+        their pools for later games to reuse. The game
+        must not be used afterwards.
+        '''
+        self.watering_can.stop_watering()
+        [p.release() for p in self.plants]
+        self.plants = []
+        self.on_belt = set()
+
+    def get_score(self):
+        '''
+        Number of plants taken off the conveyor belt,
+        including retired ones
+        '''
+        return len(self.plants) + self.archive['plants'] - len(self.on_belt)
+
+    def get_draw_order(self, viewport=None):
+        '''
+        Every sprite in the scene, in the order to
+        draw them: floating items by depth around the
+        person, then the conveyor belts.
+
+        If viewport is given, only sprites that may
+        overlap it are included, cut out of the render
+        queue's order and found by the belts' own
+        queries, so the cost follows what is visible
+        rather than the size of the world.
+        '''
+        if viewport is None:
+            return self.render_queue.get_draw_order(self.person) +\
+                self.belts.get_trays()
+
+        # Labels and water spray reach a little past the
+        # rects we know about, and interpolation draws
+        # sprites a little away from them
+        area = viewport.inflate(2 * CULL_MARGIN, 2 * CULL_MARGIN)
+        return self.render_queue.get_draw_order(self.person, area) +\
+            self.belts.query(area)
+
+    def get_positions(self, viewport=None):
+        '''
+        Positions of every sprite that may move in a
+        tick, for interpolating between ticks.
+
+        If viewport is given, empty trays are only
+        included where get_draw_order() would look
+        for them, so that trays elsewhere are left
+        to be put in place when they are needed.
+        '''
+        if viewport is None:
+            trays = self.belts.get_trays()
+        else:
+            area = viewport.inflate(2 * CULL_MARGIN, 2 * CULL_MARGIN)
+            trays = [plant.holder for plant in self.on_belt] +\
+                self.belts.query(area)
+
+        movers = [self.person, self.watering_can] + trays
+        movers += [m.subsprite for m in movers\
+            if m.subsprite is not None and m is not self.watering_can]
+
+        return {m: m.rect.topleft for m in movers}
+
+    def get_blits(self):
+        return [b for item in self.get_draw_order() for b in item.get_blits()]
+
+    def draw(self, screen):
+        screen.blits(self.get_blits(), False)
+
+class Camera:
+    '''
+    Window-sized view onto the world that follows a
+    sprite, kept inside the world's edges. Sprites
+    live in world coordinates; subtract offset to
+    get screen coordinates.
+    '''
+    def __init__(self, width=WIDTH, height=HEIGHT):
+        self.rect = pygame.Rect(0, 0, width, height)
+
+    @property
+    def offset(self):
+        return self.rect.topleft
+
+    def follow(self, sprite, shift=(0, 0)):
+        '''
+        Center on a sprite, displaced by shift, as far
+        as the edges of the world allow
+        '''
+        self.rect.center = sprite.get_rect().move(shift).center
+        self.rect.clamp_ip(pygame.Rect(0, 0, WORLD_WIDTH, WORLD_HEIGHT))
+
+    def draw(self, screen, items):
+        '''
+        Draw items, given in world coordinates and in
+        drawing order, as seen from the camera
+        '''
+        screen.blits(get_screen_blits(items, self.offset), False)
+
+def get_screen_blits(items, offset):
+    '''
+    Blits of items moved from world coordinates to
+    the screen of a camera at offset
+    '''
+    ox, oy = offset
+    if ox == 0 and oy == 0:
+        return [b for item in items for b in item.get_blits()]
+
+    return [(image, (x - ox, y - oy)) for item in items\
+        for image, (x, y) in item.get_blits()]
+
+def merge_rects(rects):
+    '''
+    Union overlapping rects until no two overlap.
+    Empty rects are dropped.
+    '''
+    merged = []
+    for rect in rects:
+        if rect.width <= 0 or rect.height <= 0:
+            continue
+
+        rect = rect.copy()
+        i = rect.collidelist(merged)
+        while i != -1:
+            rect.union_ip(merged.pop(i))
+            i = rect.collidelist(merged)
+
+        merged.append(rect)
+
+    return merged
+
+class DirtyRenderer:
+    '''
+    Repaints only the parts of the screen where a
+    sprite appeared, disappeared or changed since
+    the previous frame. draw() returns the rects to
+    pass to pygame.display.update().
+
+    Drawing is split in two. plan() works out what
+    to repaint from the sprites and returns it as a
+    frame of areas and blits that is never changed
+    afterwards; paint() puts
+    a frame on the screen without looking at any
+    sprite, so it can run on another thread while
+    the next tick is simulated.
+    '''
+    def __init__(self, background=BACKGROUND):
+        self.background = background
+        self.drawn = {}
+        self.offset = (0, 0)
+        self.full_redraw = True
+
+    def invalidate(self):
+        '''
+        Repaint the whole screen on the next frame
+        '''
+        self.full_redraw = True
+
+    def draw(self, screen, items, offset=(0, 0), overlays=(), shifts=None):
+        return self.paint(screen,\
+            self.plan(screen.get_rect(), items, offset, overlays, shifts))
+
+    def plan(self, screen_rect, items, offset=(0, 0), overlays=(), shifts=None):
+        '''
+        Plan bringing the screen up to date with items, given
+        in world coordinates and in drawing order, as
+        seen from a camera at offset. Overlays are in
+        screen coordinates and drawn on top. Moving the
+        camera repaints the whole screen.
+
+        Shifts may map items to a (dx, dy) to draw
+        them displaced by, for interpolating motion.
+        '''
+        if offset != self.offset:
+            self.offset = offset
+            self.full_redraw = True
+
+        if shifts is None:
+            shifts = {}
+
+        ox, oy = offset
+        placed = []
+        for item in items:
+            dx, dy = shifts.get(item, (0, 0))
+            placed.append((item, ox - dx, oy - dy))
+        placed.extend((item, 0, 0) for item in overlays)
+
+        drawn = {}
+        dirty = []
+        for item, px, py in placed:
+            rect = item.get_draw_rect().move(-px, -py)
+            state = (item.get_draw_state(), px, py)
+            drawn[item] = (rect, state)
+
+            previous = self.drawn.pop(item, None)
+            if previous is None:
+                dirty.append(rect)
+            elif previous[1] != state:
+                dirty.append(previous[0])
+                dirty.append(rect)
+
+        # Whatever is left was drawn last frame but is gone now
+        dirty.extend(rect for rect, _ in self.drawn.values())
+        self.drawn = drawn
+
+        if self.full_redraw:
+            self.full_redraw = False
+            return ((screen_rect.copy(), get_placed_blits(placed)),)
+
+        return tuple((area, get_placed_blits([p for p in placed\
+            if drawn[p[0]][0].colliderect(area)])) for area in merge_rects(dirty))
+
+    def paint(self, screen, frame):
+        '''
+        Repaint each area of a planned frame. Return
+        the areas.
+        '''
+        for area, blits in frame:
+            screen.set_clip(area)
+            screen.fill(self.background, area)
+            screen.blits(blits, False)
+
+        screen.set_clip(None)
+        return [area for area, _ in frame]
+
+def get_shifts(previous, alpha):
+    '''
+    How far to draw each sprite from where it is, so
+    it appears the fraction alpha of the way from its
+    previous position to its current one. Jumps of more
+    than CULL_MARGIN, like trays wrapping around the
+    belt, are not smoothed, so sprites are never drawn
+    outside the area culling keeps.
+    '''
+    shifts = {}
+    for sprite, (px, py) in previous.items():
+        x, y = sprite.rect.topleft
+        if (x, y) != (px, py) and\
+            abs(x - px) <= CULL_MARGIN and abs(y - py) <= CULL_MARGIN:
+            shifts[sprite] = (round((px - x) * (1 - alpha)),\
+                round((py - y) * (1 - alpha)))
+
+    return shifts
+
+def get_placed_blits(placed):
+    '''
+    Blits of (item, x offset, y offset) triples,
+    each item's moved by its offset
+    '''
+    return [(image, (x - px, y - py)) for item, px, py in placed\
+        for image, (x, y) in item.get_blits()]
+
+class FrameProfiler:
+    '''
+    Times the phases of each frame and counts what
+    happens in them. Hooks in the game are guarded
+    by enabled, so when profiling is off each costs
+    a single attribute check.
+
+    mark(phase) charges the time since the previous
+    mark to phase. Finished frames are averaged for
+    the on-screen overlay and, if telemetry is set,
+    written to it as JSON lines.
+
+    The overlay is drawn by DirtyRenderer like any
+    other item, on top of the scene.
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.overlay = False
+        self.telemetry = None
+        self.frame = 0
+        self.timings = {}
+        self.counters = {}
+        self.last = time.perf_counter()
+        self.history = deque(maxlen=PROFILE_WINDOW)
+        self.lines = ()
+        self.blits = []
+        self.rect = pygame.Rect(0, 0, 0, 0)
+
+    def start_telemetry(self, path):
+        self.telemetry = open(path, 'w')
+        self.enabled = True
+
+    def stop_telemetry(self):
+        if self.telemetry is not None:
+            self.telemetry.close()
+            self.telemetry = None
+
+        self.enabled = self.overlay
+
+    def toggle_overlay(self):
+        self.overlay = not self.overlay
+        self.enabled = self.overlay or self.telemetry is not None
+        self.history.clear()
+        self.set_lines(())
+
+    def begin_frame(self):
+        self.timings = {}
+        self.counters = {}
+        self.last = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.timings[phase] = self.timings.get(phase, 0) + now - self.last
+        self.last = now
+
+    def count(self, counter, amount=1):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def end_frame(self):
+        if self.telemetry is not None:
+            import json
+            self.telemetry.write(json.dumps({
+                'frame': self.frame,
+                'ms': {phase: round(seconds * 1000, 4)\
+                    for phase, seconds in self.timings.items()},
+                'counters': self.counters,
+            }) + '\n')
+
+        if self.overlay:
+            self.history.append((self.timings, self.counters))
+            if self.frame % PROFILE_REFRESH == 0:
+                self.set_lines(self.get_overlay_lines())
+
+        self.frame += 1
+
+    def get_overlay_lines(self):
+        '''
+        Mean time per phase and mean counts over
+        the recent frames
+        '''
+        frames = len(self.history)
+        timings = {}
+        counters = {}
+        for frame_timings, frame_counters in self.history:
+            for phase, seconds in frame_timings.items():
+                timings[phase] = timings.get(phase, 0) + seconds
+            for counter, amount in frame_counters.items():
+                counters[counter] = counters.get(counter, 0) + amount
+
+        busy = sum(s for p, s in timings.items() if p != 'idle')
+        lines = ['{:<17}{:>7.2f} ms'.format('busy', busy * 1000 / frames)]
+        lines.extend('{:<17}{:>7.2f} ms'.format(phase, seconds * 1000 / frames)\
+            for phase, seconds in timings.items())
+        lines.extend('{:<17}{:>7.1f}'.format(counter, amount / frames)\
+            for counter, amount in counters.items())
+
+        return tuple(lines)
+
+    def set_lines(self, lines):
+        self.lines = lines
+        self.blits = []
+        self.rect = pygame.Rect(PROFILE_MARGIN, PROFILE_MARGIN, 0, 0)
+        y = PROFILE_MARGIN
+        for line in lines:
+            image = render_text(line, (255, 255, 255), 12, (0, 0, 0))
+            self.blits.append((image, (PROFILE_MARGIN, y)))
+            self.rect.union_ip(image.get_rect(topleft=(PROFILE_MARGIN, y)))
+            y += image.get_height()
+
+    def get_blits(self):
+        return self.blits
+
+    def get_draw_rect(self):
+        return self.rect
+
+    def get_draw_state(self):
+        return self.lines
+
+profiler = FrameProfiler()
+
+class StartupTimer:
+    '''
+    Times each phase of starting the game, from when
+    this module started loading to the first frame.
+    mark(phase) charges the time since the previous
+    mark to phase.
+    '''
+    def __init__(self, start=None):
+        if start is None:
+            start = time.perf_counter()
+        self.start = start
+        self.last = start
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def get_report(self):
+        lines = ['{:<12}{:>8.1f} ms'.format(phase, seconds * 1000)\
+            for phase, seconds in self.phases]
+        lines.append('{:<12}{:>8.1f} ms'.format('total',\
+            (self.last - self.start) * 1000))
+        return '\n'.join(lines)
+
+def run_headless(ticks, inputs=None, game=None, fast_forward=False):
+    '''
+    Advance a game by up to the given number of
+    ticks as fast as possible, without a display
+    or frame cap. Inputs is an optional iterable of
+    key states, one per tick; once it runs out, no
+    keys are pressed, and if fast_forward is set
+    the idle ticks are skipped through
+    Game.fast_forward.
+
+    Stops early if the game ends. Returns the game.
+    '''
+    if game is None:
+        game = Game()
+
+    end = game.cycle + ticks
+    for key in (inputs if inputs is not None else ()):
+        if game.cycle >= end or game.step(key) is not None:
+            return game
+
+    if fast_forward:
+        game.fast_forward(end - game.cycle)
+    else:
+        while game.cycle < end and game.step(NO_KEYS) is None:
+            pass
+
+    return game
+
+class PathTree:
+    '''
+    Shortest paths from anywhere on a grid to one
+    goal cell, stepping between the four neighbours
+    of each cell and around blocked cells. Blocked
+    is indexed [column][row]; the start and goal
+    cells may themselves be blocked.
+
+    The tree is grown by a breadth-first search out
+    from the goal, only as far as the starts asked
+    about so far need, and picks up where it left
+    off for the next one.
+    '''
+    def __init__(self, blocked, goal):
+        self.blocked = blocked
+        self.goal = goal
+        self.next_cells = {goal: None}
+        self.frontier = deque([goal])
+
+    def get_path(self, start):
+        '''
+        Cells after start up to the goal, or an empty
+        tuple if there is no way through
+        '''
+        blocked = self.blocked
+        columns = len(blocked)
+        rows = len(blocked[0])
+        next_cells = self.next_cells
+        while start not in next_cells and self.frontier:
+            cell = self.frontier.popleft()
+            x, y = cell
+            for step in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+                step_x, step_y = step
+                if not (0 <= step_x < columns and 0 <= step_y < rows) or\
+                    step in next_cells:
+                    continue
+
+                # Blocked cells are only ever where a
+                # path starts, so lead nowhere
+                next_cells[step] = cell
+                if not blocked[step_x][step_y]:
+                    self.frontier.append(step)
+
+        if start not in next_cells:
+            return ()
+
+        path = []
+        cell = start
+        while cell != self.goal:
+            cell = next_cells[cell]
+            path.append(cell)
+
+        return tuple(path)
+
+def get_cells(low, high):
+    '''
+    Slice of the path planning cells whose corner
+    lies strictly between low and high
+    '''
+    return slice(max(0, low // PATH_CELL + 1), max(0, -(-high // PATH_CELL)))
+
+class Autopilot:
+    '''
+    Plays a game through the same key states a
+    player would press. It takes plants off the
+    belt and sets them down in a grid of slots,
+    parks the watering can whenever its hands are
+    needed, and sees first to the plant predicted
+    to die first, watering it once it runs low on
+    the floor or fetching it from the belt.
+
+    Everything is approached from the north and
+    done facing south. Paths are planned on a
+    coarse grid of where the person can stand,
+    built from the belts and whatever is set down
+    on the floor, with one PathTree per goal. The
+    grid is only rebuilt when something is picked
+    up, set down or retired, and the last
+    PATH_GRIDS grids are kept along with the trees
+    for their last PATH_TREES goals, since carrying
+    something and then putting it back gives the
+    same grid again.
+    '''
+    MOVES = {
+        Sprite.NORTH: KeyState((pygame.K_UP,)),
+        Sprite.EAST: KeyState((pygame.K_RIGHT,)),
+        Sprite.SOUTH: KeyState((pygame.K_DOWN,)),
+        Sprite.WEST: KeyState((pygame.K_LEFT,)),
+    }
+    PICK_UP = KeyState((pygame.K_SPACE,))
+    WATER = KeyState((pygame.K_LSHIFT,))
+
+    def __init__(self, game, rng=None):
+        self.game = game
+        self.rng = rng if rng is not None else random
+
+        # Only the band the person starts in is played
+        person = game.person.rect
+        self.belt = next((b for b in game.belts if b.top >= person.bottom),\
+            game.belts[-1])
+        self.trays = set(self.belt.trays)
+        band_top = self.belt.bottom - HEIGHT
+        self.park = (2 * PATH_CELL, band_top + PLANT_BUFFER)
+        # Slots, given by the middle of the bottom of
+        # the plant set down in each, leave room to
+        # stand over the first row and to walk along
+        # the belt past the last one
+        columns, rows = SLOT_SPACING
+        self.slots = [(x, bottom)\
+            for bottom in range(band_top + 2 * rows - 2 * PLANT_BUFFER,\
+                self.belt.top - rows // 2 + 1, rows)\
+            for x in range(columns, WORLD_WIDTH - columns // 2, columns)]
+
+        self.grid_key = None
+        self.grid = None
+        self.grids = OrderedDict()
+        self.trees = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.floor = []
+        self.on_floor = set()
+        self.rows = numpy.zeros(0, dtype=numpy.int64)
+        self.free_slots = []
+
+        self.goal = None
+        self.path = ()
+        self.watering = None
+        self.last_key = NO_KEYS
+        self.last_position = None
+        self.still = 0
+        self.presses = 0
+        self.wander = 0
+        self.wander_key = NO_KEYS
+
+    def get_key(self):
+        '''
+        Key state to press on the next tick
+        '''
+        self.update_grid()
+        self.check_stuck()
+        if self.wander > 0:
+            self.wander -= 1
+            key = self.wander_key
+        else:
+            key = self.choose_key()
+
+        self.last_key = key
+        return key
+
+    def choose_key(self):
+        '''
+        Set down whatever plant we carry, then see to
+        any plant that would die soon, then take a
+        plant off the belt, then top up the rest
+        '''
+        held = self.game.person.subsprite
+        if isinstance(held, Plant):
+            return self.set_down_plant()
+
+        plant = self.get_thirsty_plant(THIRST_TICKS)
+        if plant is None:
+            plant = self.get_belt_plant()
+        if plant is None:
+            plant = self.get_thirsty_plant()
+
+        if plant is not None and plant not in self.on_floor:
+            if held is not None:
+                return self.approach(self.park) or self.press_space()
+
+            return self.pick_up(plant)
+
+        if held is None:
+            return self.fetch_can()
+        elif plant is not None:
+            return self.water(plant)
+
+        return NO_KEYS
+
+    def update_grid(self):
+        '''
+        Rebuild the occupancy grid if anything on the
+        floor has been picked up, set down or retired,
+        and switch to the paths found on it before
+        '''
+        game = self.game
+        key = (game.person.subsprite, game.archive['plants'])
+        if key == self.grid_key:
+            return
+
+        self.grid_key = key
+        self.presses = 0
+        self.floor = [p for p in game.plants if p.holder is None]
+        self.on_floor = set(self.floor)
+        self.rows = numpy.array([p.row for p in self.floor], dtype=numpy.int64)
+
+        # A cell is blocked if the person's top left
+        # corner cannot be anywhere near it. Whatever
+        # we carry sticks out to the sides, and above
+        # us when we face north.
+        width, height = game.person.rect.size
+        slack = PERSON_SPEED
+        side = top = 0
+        if game.person.subsprite is not None:
+            rect = game.person.subsprite.get_rect()
+            side = max(0, rect.width - width // 2)
+            top = max(0, rect.height + 3 * PLANT_PLACEMENT_BUFFER - height)
+
+        blocked = numpy.zeros((WORLD_WIDTH // PATH_CELL + 1,\
+            WORLD_HEIGHT // PATH_CELL + 1), dtype=bool)
+        blocked[get_cells(-PATH_CELL, side), :] = True
+        blocked[get_cells(WORLD_WIDTH - width - side - slack, WORLD_WIDTH * 2), :] = True
+        blocked[:, get_cells(-PATH_CELL, top)] = True
+        blocked[:, get_cells(WORLD_HEIGHT - height - slack, WORLD_HEIGHT * 2)] = True
+
+        # Keep off the belts, with room for whatever
+        # is carried in front, and out of their
+        # crossings so we stay in our band
+        for belt in game.belts:
+            blocked[:, get_cells(belt.top - height - slack - PLANT_BUFFER,\
+                belt.bottom + slack)] = True
+
+        # and keep our feet off everything's feet
+        items = list(self.floor)
+        if game.watering_can.holder is None:
+            items.append(game.watering_can)
+        for item in items:
+            edge = item.get_bottom_edge()
+            blocked[get_cells(edge.left - width - slack, edge.right + slack),\
+                get_cells(edge.top - height - slack,\
+                edge.bottom - height + BOTTOM_EDGE_BUFFER + slack)] = True
+
+        # A slot is taken if anything is set down near
+        # the plant that would go in it
+        taken = [item.get_rect() for item in items]
+        columns, rows = SLOT_SPACING
+        self.free_slots = [(x, bottom) for x, bottom in self.slots\
+            if pygame.Rect(x - columns // 4, bottom - rows, columns // 2,\
+                rows + 2 * PLANT_PLACEMENT_BUFFER).collidelist(taken) < 0]
+
+        key = blocked.tobytes()
+        if key in self.grids:
+            self.grids.move_to_end(key)
+        else:
+            self.grids[key] = (blocked.tolist(), OrderedDict())
+            if len(self.grids) > PATH_GRIDS:
+                self.grids.popitem(last=False)
+
+        grid, trees = self.grids[key]
+        if grid is not self.grid:
+            self.grid = grid
+            self.trees = trees
+            self.goal = None
+            self.path = ()
+
+    def plan(self, start, goal):
+        '''
+        Path between two cells, from the goal's tree
+        if one has been grown on this grid before
+        '''
+        tree = self.trees.get(goal)
+        if tree is None:
+            self.misses += 1
+            tree = self.trees[goal] = PathTree(self.grid, goal)
+            if len(self.trees) > PATH_TREES:
+                self.trees.popitem(last=False)
+        else:
+            self.hits += 1
+            self.trees.move_to_end(goal)
+
+        return tree.get_path(start)
+
+    def get_cell(self, position):
+        x, y = position
+        return (min(max(0, round(x / PATH_CELL)), len(self.grid) - 1),\
+            min(max(0, round(y / PATH_CELL)), len(self.grid[0]) - 1))
+
+    def check_stuck(self):
+        '''
+        Wander off for a while if walking has not
+        moved us or space has not picked anything up
+        '''
+        position = self.game.person.rect.topleft
+        if position == self.last_position and self.last_key in self.MOVES.values():
+            self.still += 1
+        else:
+            self.still = 0
+        self.last_position = position
+
+        if self.still >= STUCK_TICKS or self.presses >= STUCK_TICKS:
+            self.still = 0
+            self.presses = 0
+            self.goal = None
+            self.path = ()
+            self.wander = STUCK_TICKS
+            self.wander_key = self.rng.choice(list(self.MOVES.values()))
+
+    def approach(self, position, slack=PERSON_SPEED):
+        '''
+        Key state to walk towards standing with our
+        top left corner at position, facing south, or
+        None once we are there
+        '''
+        rect = self.game.person.rect
+        x = min(max(0, position[0]), WORLD_WIDTH - rect.width)
+        dx = x - rect.x
+        dy = position[1] - rect.y
+        if abs(dx) < slack and abs(dy) <= PERSON_SPEED + 1 and\
+            self.game.person.facing == Sprite.SOUTH:
+            return None
+
+        key = self.follow_path((x, position[1]))
+        if key is not None:
+            return key
+
+        # Close enough to walk straight there, ending
+        # with a step south to face that way, or
+        # turning south if north is blocked
+        if abs(dx) >= slack:
+            return self.MOVES[Sprite.EAST if dx > 0 else Sprite.WEST]
+        elif dy >= PERSON_SPEED or self.still > 0:
+            return self.MOVES[Sprite.SOUTH]
+
+        return self.MOVES[Sprite.NORTH]
+
+    def follow_path(self, position):
+        '''
+        Key state to walk along the planned path to
+        position, or None once it runs out
+        '''
+        rect = self.game.person.rect
+        goal = self.get_cell(position)
+        if goal != self.goal:
+            self.goal = goal
+            self.path = self.plan(self.get_cell(rect.topleft), goal)
+
+        while self.path:
+            x, y = self.path[0]
+            dx = x * PATH_CELL - rect.x
+            dy = y * PATH_CELL - rect.y
+            if abs(dx) >= PERSON_SPEED or abs(dy) >= PERSON_SPEED:
+                break
+            self.path = self.path[1:]
+        else:
+            return None
+
+        if abs(dx) >= abs(dy):
+            return self.MOVES[Sprite.EAST if dx > 0 else Sprite.WEST]
+
+        return self.MOVES[Sprite.SOUTH if dy > 0 else Sprite.NORTH]
+
+    def press_space(self):
+        '''
+        Press space, letting go of it in between
+        '''
+        if self.last_key is self.PICK_UP:
+            return NO_KEYS
+
+        self.presses += 1
+        return self.PICK_UP
+
+    def get_thirsty_plant(self, ticks=None):
+        '''
+        Plant on the floor we are watering, or else the
+        one predicted to die first of those running
+        low on the floor and those we could fetch from
+        the belt, if it dies within the given number
+        of ticks. None if there is no such plant.
+        '''
+        plant = self.watering
+        if plant is not None and plant in self.on_floor and plant.alive and\
+            plant.water_level < WATER_UNTIL * plant.max_water_level:
+            return plant
+
+        self.watering = None
+        table = self.game.water_table
+        low = numpy.flatnonzero(table.water_level[self.rows] <\
+            WATER_BELOW * table.max_water_level[self.rows])
+        plants = [self.floor[i] for i in low] + self.get_belt_plants()
+        if not plants:
+            return None
+
+        rows = numpy.array([p.row for p in plants], dtype=numpy.int64)
+        death_ticks, _ = table.predict_deaths(rows)
+        first = numpy.argmin(death_ticks)
+        if ticks is not None and death_ticks[first] - table.tick > ticks:
+            return None
+
+        plant = plants[first]
+        if plant in self.on_floor:
+            self.watering = plant
+
+        return plant
+
+    def get_free_slot(self):
+        '''
+        Slot nearest to us that nothing is set down
+        in, or None if they are all taken
+        '''
+        if not self.free_slots:
+            return None
+
+        person = self.game.person.rect
+        return min(self.free_slots, key=lambda slot:\
+            abs(slot[0] - person.centerx) + abs(slot[1] - person.bottom))
+
+    def get_belt_plants(self):
+        '''
+        Plants on our belt that will not leave the
+        world before we reach them, if there is a
+        free slot to set one down in
+        '''
+        if self.get_free_slot() is None:
+            return []
+
+        person = self.game.person.rect
+        return [p for p in self.game.on_belt if p.holder in self.trays and\
+            2 * TRAY_WIDTH <= p.rect.centerx <= WORLD_WIDTH - person.width]
+
+    def get_belt_plant(self):
+        '''
+        Plant we could fetch from the belt nearest to
+        us, or None
+        '''
+        person = self.game.person.rect
+        return min(self.get_belt_plants(), default=None,\
+            key=lambda p: abs(p.rect.centerx - person.centerx))
+
+    def pick_up(self, plant):
+        '''
+        Meet a plant on the belt from above, leading
+        it by however far the belt carries it while
+        we walk there
+        '''
+        person = self.game.person.rect
+        y = self.belt.top - person.height
+        ticks = (abs(plant.rect.centerx - person.centerx) + abs(y - person.y)) /\
+            PERSON_SPEED
+        x = plant.rect.centerx - person.width // 2 - int(ticks * TRAY_SPEED)
+        return self.approach((x, y), TRAY_WIDTH // 4) or self.press_space()
+
+    def set_down_plant(self):
+        slot = self.get_free_slot()
+        if slot is None:
+            return self.press_space()
+
+        person = self.game.person.rect
+        x, bottom = slot
+        return self.approach((x - person.width // 2,\
+            bottom - PLANT_PLACEMENT_BUFFER - person.height)) or self.press_space()
+
+    def fetch_can(self):
+        can = self.game.watering_can.rect
+        person = self.game.person.rect
+        return self.approach((can.centerx - person.width // 2,\
+            can.bottom - BOTTOM_EDGE_BUFFER - person.height)) or self.press_space()
+
+    def water(self, plant):
+        '''
+        Stand over a plant and water it
+        '''
+        rect = plant.get_rect()
+        person = self.game.person.rect
+        return self.approach((rect.centerx - person.width // 2,\
+            rect.top + 2 * BOTTOM_EDGE_BUFFER - person.height)) or self.WATER
+
+def autopilot_policy(game, rng=None):
+    '''
+    Key states an Autopilot presses, one per tick,
+    forever
+    '''
+    pilot = Autopilot(game, rng)
+    while True:
+        yield pilot.get_key()
+
+# Keys that affect the simulation, in bit order
+RECORDED_KEYS = (
+    pygame.K_LEFT,
+    pygame.K_RIGHT,
+    pygame.K_UP,
+    pygame.K_DOWN,
+    pygame.K_SPACE,
+    pygame.K_LSHIFT,
+    pygame.K_RSHIFT,
+)
+
+def get_key_mask(key):
+    mask = 0
+    for bit, code in enumerate(RECORDED_KEYS):
+        if key[code]:
+            mask |= 1 << bit
+
+    return mask
+
+key_states = {}
+
+def get_key_state(mask):
+    '''
+    Shared KeyState for a key mask
+    '''
+    key = key_states.get(mask)
+    if key is None:
+        key = KeyState(code for bit, code in enumerate(RECORDED_KEYS)\
+            if mask & (1 << bit))
+        key_states[mask] = key
+
+    return key
+
+class InputRecorder:
+    '''
+    Records the key state of every tick of a game.
+    The file holds a header with the game's seed,
+    tick count and world size, then runs of
+    identical ticks as (count, key mask) pairs.
+    '''
+    HEADER = struct.Struct('<4sBQIII')
+    RUN = struct.Struct('<HB')
+
+    def __init__(self, seed):
+        self.seed = seed
+        self.ticks = 0
+        self.runs = []
+
+    def record(self, key):
+        mask = get_key_mask(key)
+        self.ticks += 1
+        if len(self.runs) > 0 and self.runs[-1][1] == mask and\
+            self.runs[-1][0] < 0xFFFF:
+            self.runs[-1][0] += 1
+        else:
+            self.runs.append([1, mask])
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(InputRecorder.HEADER.pack(RECORDING_MAGIC,\
+                RECORDING_VERSION, self.seed, self.ticks,\
+                WORLD_WIDTH, WORLD_HEIGHT))
+            f.write(b''.join(InputRecorder.RUN.pack(count, mask)\
+                for count, mask in self.runs))
+
+def load_recording(path):
+    '''
+    Read a recording made by InputRecorder. Return
+    the seed and the list of per-tick key states.
+    The recording must have been made in a world of
+    the current size.
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    header_size = InputRecorder.HEADER.size
+    magic, version, seed, ticks, width, height =\
+        InputRecorder.HEADER.unpack_from(data)
+    if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+        raise ValueError('{} is not a version {} recording'.format(\
+            path, RECORDING_VERSION))
+
+    if (width, height) != (WORLD_WIDTH, WORLD_HEIGHT):
+        raise ValueError('{} is a recording of a {}x{} world'.format(\
+            path, width, height))
+
+    inputs = []
+    for count, mask in InputRecorder.RUN.iter_unpack(data[header_size:]):
+        inputs.extend([get_key_state(mask)] * count)
+
+    return seed, inputs[:ticks]
+
+def replay(path, fast_forward=False):
+    '''
+    Replay a recording headlessly at full speed.
+    Returns the game.
+    '''
+    seed, inputs = load_recording(path)
+    return run_headless(len(inputs), inputs, Game(seed), fast_forward)
+
+def parse_size(text):
+    '''
+    Parse a size given as WIDTHxHEIGHT
+    '''
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+# Where a plant is, beyond its own position
+ON_FLOOR = 0
+ON_BELT = 1
+IN_HANDS = 2
+
+SNAPSHOT_PLANT = numpy.dtype([
+    ('x', '<i4'),
+    ('y', '<i4'),
+    ('facing', 'i1'),
+    ('immune_from_obstacles', '?'),
+    ('immune_from_semi_obstacles', '?'),
+    ('container_x', '<i4'),
+    ('container_y', '<i4'),
+    ('container_facing', 'i1'),
+    ('container_immune_from_obstacles', '?'),
+    ('container_immune_from_semi_obstacles', '?'),
+    ('holder', 'i1'),
+    ('belt', '<i4'),
+    ('tray', '<i4'),
+])
+
+# Magic, version and length of the JSON header
+SNAPSHOT_HEADER = struct.Struct('<4sII')
+
+def get_sprite_state(sprite):
+    return [sprite.rect.left, sprite.rect.top, sprite.facing,\
+        sprite.immune_from_obstacles, sprite.immune_from_semi_obstacles]
+
+def set_sprite_state(sprite, state):
+    '''
+    Put a lone sprite back as get_sprite_state()
+    found it. Subsprites move along, so set them after.
+    '''
+    left, top, facing, immune, semi_immune = state
+    if facing != sprite.facing:
+        sprite.set_facing(facing)
+    sprite.rect.size = sprite.image.get_size()
+    sprite.shift(left - sprite.rect.left, top - sprite.rect.top)
+    sprite.immune_from_obstacles = bool(immune)
+    sprite.immune_from_semi_obstacles = bool(semi_immune)
+
+def save_snapshot(game, path):
+    '''
+    Save the complete state of a game. The file is a
+    JSON header followed by NumPy arrays, each aligned
+    to SNAPSHOT_ALIGN bytes, for every plant's sprites
+    and water state.
+    '''
+    import json
+
+    table = game.water_table
+    rows = [plant.row for plant in game.plants]
+    trays = {tray: (b, t) for b, belt in enumerate(game.belts)\
+        for t, tray in enumerate(belt.trays)}
+
+    plants = numpy.zeros(len(game.plants), dtype=SNAPSHOT_PLANT)
+    for i, plant in enumerate(game.plants):
+        holder = ON_FLOOR
+        belt, tray = trays.get(plant.holder, (-1, -1))
+        if belt >= 0:
+            holder = ON_BELT
+        elif plant.holder is game.person:
+            holder = IN_HANDS
+
+        plants[i] = tuple(get_sprite_state(plant) +\
+            get_sprite_state(plant.subsprite) + [holder, belt, tray])
+
+    arrays = [('plants', plants)] + [(name, getattr(table, name)[rows])\
+        for name, _ in PlantWaterTable.COLUMNS]
+
+    person = game.person
+    can = game.watering_can
+    header = {
+        'version': SNAPSHOT_VERSION,
+        'world': [WORLD_WIDTH, WORLD_HEIGHT],
+        'seed': game.seed,
+        'max_plants': game.max_plants,
+        'cycle': game.cycle,
+        'rng': list(game.rng.getstate()),
+        'tick': table.tick,
+        'belt_cycles': [belt.cycle for belt in game.belts],
+        'person': get_sprite_state(person),
+        'hands_free': person.hands_free,
+        'archive': game.archive,
+        'watering_can': get_sprite_state(can),
+        'can_held': can.holder is person,
+        'spray': None if can.subsprite is None else get_sprite_state(can.subsprite),
+        'faulting_plant': None if game.faulting_plant is None else\
+            game.plants.index(game.faulting_plant),
+        'arrays': {},
+    }
+
+    # Offsets depend on the header's length, which
+    # depends on the offsets, so lay out twice
+    for _ in range(2):
+        offset = SNAPSHOT_HEADER.size + len(json.dumps(header))
+        offset = -(-offset // SNAPSHOT_ALIGN) * SNAPSHOT_ALIGN
+        for name, array in arrays:
+            header['arrays'][name] = {'dtype': array.dtype.descr\
+                if array.dtype.names else array.dtype.str,\
+                'shape': list(array.shape), 'offset': offset}
+            offset += -(-array.nbytes // SNAPSHOT_ALIGN) * SNAPSHOT_ALIGN
+
+    data = json.dumps(header).encode()
+    with open(path, 'wb') as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(data)))
+        f.write(data)
+        for name, array in arrays:
+            f.write(b'\0' * (header['arrays'][name]['offset'] - f.tell()))
+            f.write(array.tobytes())
+
+def load_snapshot(path):
+    '''
+    Restore a game saved by save_snapshot(). The
+    arrays are memory-mapped and copied straight
+    into the game's water table.
+    '''
+    import json
+
+    with open(path, 'rb') as f:
+        magic, version, header_size = SNAPSHOT_HEADER.unpack(\
+            f.read(SNAPSHOT_HEADER.size))
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError('{} is not a version {} snapshot'.format(\
+                path, SNAPSHOT_VERSION))
+
+        header = json.loads(f.read(header_size))
+
+    if header['world'] != [WORLD_WIDTH, WORLD_HEIGHT]:
+        raise ValueError('{} is a snapshot of a {}x{} world'.format(\
+            path, *header['world']))
+
+    arrays = {}
+    for name, layout in header['arrays'].items():
+        dtype = layout['dtype']
+        if isinstance(dtype, list):
+            dtype = [tuple(field) for field in dtype]
+        shape = tuple(layout['shape'])
+        if 0 in shape:
+            # Empty arrays cannot be mapped
+            arrays[name] = numpy.zeros(shape, dtype)
+        else:
+            arrays[name] = numpy.memmap(path, numpy.dtype(dtype), 'r',\
+                layout['offset'], shape)
+
+    game = Game(header['seed'], header.get('max_plants'))
+    person = game.person
+    can = game.watering_can
+    table = game.water_table
+
+    for belt, cycle in zip(game.belts, header['belt_cycles']):
+        belt.cycle = cycle
+        belt.get_trays()
+
+    # Held plants keep their offset from the person
+    set_sprite_state(person, header['person'])
+    person.hands_free = header['hands_free']
+
+    states = arrays['plants'].tolist()
+    plants = [plant_pool.acquire(0, 0, table, None) for _ in states]
+    table.extend(plants, arrays)
+    for plant, state in zip(plants, states):
+        # Nothing holds or indexes the plant yet, so
+        # it can be put in place without shift()
+        left, top, facing, immune, semi_immune = state[:5]
+        rect = plant.rect
+        plant.move_unsafe(left - rect.left, top - rect.top)
+        plant.invalidate()
+        if facing != plant.facing:
+            plant.set_facing(facing)
+        plant.immune_from_obstacles = bool(immune)
+        plant.immune_from_semi_obstacles = bool(semi_immune)
+
+        container = plant.subsprite
+        container.offset = (state[5] - left, state[6] - top)
+        container.invalidate()
+        facing, immune, semi_immune = state[7:10]
+        if facing != container.facing:
+            container.set_facing(facing)
+        container.immune_from_obstacles = bool(immune)
+        container.immune_from_semi_obstacles = bool(semi_immune)
+
+        holder, belt, tray = state[10:]
+        if holder == ON_BELT:
+            plant.holder = game.belts[belt].trays[tray]
+            plant.holder.subsprite = plant
+        elif holder == IN_HANDS:
+            plant.holder = person
+            person.subsprite = plant
+
+    game.add_plants(plants)
+    table.tick = header['tick']
+    table.reschedule()
+
+    set_sprite_state(can, header['watering_can'])
+    if header['can_held']:
+        can.holder = person
+        person.subsprite = can
+    if header['spray'] is not None:
+        can.subsprite = spray_pool.acquire(0, 0)
+        can.subsprite.holder = can
+        set_sprite_state(can.subsprite, header['spray'])
+    game.semi_obstacles.update(can)
+
+    version, internal, gauss = header['rng']
+    game.rng.setstate((version, tuple(internal), gauss))
+    game.cycle = header['cycle']
+    game.archive.update(header.get('archive', {}))
+    if header['faulting_plant'] is not None:
+        game.faulting_plant = game.plants[header['faulting_plant']]
+
+    # Plants were queued where they were put, but
+    # the can was queued when the game was made
+    game.render_queue.touch((can,))
+    game.render_queue.sort()
+    return game
 
 def get_cause(plant):
     if plant.overwatered:
@@ -575,160 +3280,326 @@ def get_cause(plant):
     
     return ''
 
+def get_summary(game):
+    '''
+    One-line outcome of a game for headless runs
+    '''
+    cause = ''
+    if game.faulting_plant is not None:
+        cause = get_cause(game.faulting_plant)
+
+    return 'seed: {}  cycles: {}  plants: {}  score: {}  {}'.format(\
+        game.seed, game.cycle, len(game.plants), game.get_score(), cause)
+
 def show_game_start(screen):
     '''
     Instructional screen at beginning
     '''
-    game_start_font = pygame.font.SysFont('Courier', 30)
-    info_font = pygame.font.SysFont('Courier', 12)
-
     x = 10
     next_y = 10
 
-    game_start_text = game_start_font.render('Botanical Bonanza', True,\
-        (0, 0, 0), (255, 255, 255))
+    game_start_text = render_text('Botanical Bonanza',\
+        (0, 0, 0), 30, (255, 255, 255))
     screen.blit(game_start_text, (x, next_y))
     next_y += game_start_text.get_rect().height
 
-    move_text = info_font.render('  arrow keys:  move',\
-        True, (0, 0, 0), (255, 255, 255))
+    move_text = render_text('  arrow keys:  move',\
+        (0, 0, 0), 12, (255, 255, 255))
     screen.blit(move_text, (x, next_y))
     next_y += move_text.get_rect().height
 
-    object_text = info_font.render('       space:  pick up or put down object',\
-        True, (0, 0, 0), (255, 255, 255))
+    object_text = render_text('       space:  pick up or put down object',\
+        (0, 0, 0), 12, (255, 255, 255))
     screen.blit(object_text, (x, next_y))
     next_y += object_text.get_rect().height
 
-    water_text = info_font.render('       shift:  water plant',\
-        True, (0, 0, 0), (255, 255, 255))
+    water_text = render_text('       shift:  water plant',\
+        (0, 0, 0), 12, (255, 255, 255))
     screen.blit(water_text, (x, next_y))
     next_y += water_text.get_rect().height
 
-    enter_text = info_font.render('Press ENTER to play!',\
-        True, (0, 0, 0), (255, 255, 255))
+    enter_text = render_text('Press ENTER to play!',\
+        (0, 0, 0), 12, (255, 255, 255))
     screen.blit(enter_text, (x, next_y))
 
-def show_game_over(plant, score, screen):
+def show_game_over(plant, score, screen, camera=None):
     '''
     Shows screen when game ends, along with
     reason for game ending
     '''
     red_x = Sprite("assets/x.png", plant.get_rect().left, plant.get_rect().bottom)
-    red_x.draw(screen)
+    if camera is None:
+        red_x.draw(screen)
+    else:
+        camera.draw(screen, [red_x])
 
     x = 10
     next_y = 10
 
-    game_over_font = pygame.font.SysFont('Courier', 50)
-    info_font = pygame.font.SysFont('Courier', 12)
-
-    game_over_text = game_over_font.render('GAME OVER', True,\
-        (0, 0, 0), (255, 255, 255))
+    game_over_text = render_text('GAME OVER',\
+        (0, 0, 0), 50, (255, 255, 255))
     screen.blit(game_over_text, (x, next_y))
     next_y += game_over_text.get_rect().height
 
-    cause_text = info_font.render(get_cause(plant),\
-        True, (0, 0, 0), (255, 255, 255))
+    cause_text = render_text(get_cause(plant),\
+        (0, 0, 0), 12, (255, 255, 255))
     screen.blit(cause_text, (x, next_y))
     next_y += cause_text.get_rect().height
 
-    score_text = info_font.render(\
+    score_text = render_text(\
         'Score (plants in play): {}'.format(score),\
-        True, (0, 0, 0), (255, 255, 255))
+        (0, 0, 0), 12, (255, 255, 255))
     screen.blit(score_text, (x, next_y))
     next_y += score_text.get_rect().height
 
-    enter_text = info_font.render('Press ENTER to exit.',\
-        True, (0, 0, 0), (255, 255, 255))
+    enter_text = render_text('Press ENTER to exit.',\
+        (0, 0, 0), 12, (255, 255, 255))
     screen.blit(enter_text, (x, next_y))
 
-def main():
+def main(seed=None, record_path=None, telemetry_path=None, snapshot_path=None,\
+    threaded=False, startup_report=False, max_plants=None):
     '''
-    Main game driver.
+    Main game driver. The simulation runs at a fixed
+    TICK_RATE, catching up with several ticks in a
+    frame when drawing falls behind, and frames show
+    sprites interpolated between the last two ticks.
+
+    If record_path is given,
+    the game's inputs are saved there on exit. If
+    telemetry_path is given, per-frame timings are
+    streamed there as JSON lines. F3 toggles the
+    profiler overlay. If snapshot_path is given,
+    play resumes from that snapshot.
+
+    If threaded is set, each frame is painted on a
+    worker thread while the ticks for the next one
+    are simulated. The display is only ever updated
+    from this thread.
+
+    If startup_report is set, the time taken by
+    each phase of starting up is printed once the
+    first frame is on screen.
+
+    If max_plants is given, the game retires its
+    oldest plants past that many, as in Game.
 
     Inspired by:
     https://docs.replit.com/tutorials/14-2d-platform-game
     '''
+    startup = StartupTimer(import_started)
+    startup.mark('imports')
+
     pygame.init()
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
     clock = pygame.time.Clock()
+    startup.mark('display')
+
+    preload_assets()
+    startup.mark('assets')
+
+    if snapshot_path is not None:
+        game = load_snapshot(snapshot_path)
+        if max_plants is not None:
+            game.max_plants = max_plants
+    else:
+        game = Game(seed, max_plants)
+    startup.mark('game')
+    camera = Camera()
+    renderer = DirtyRenderer()
+    recorder = InputRecorder(game.seed)
 
-    person = Person(100, 200)
-    watering_can = WateringCan(300, 200)
-    plants = []
-    belt = ConveyorBelt()
-    obstacles = belt.get_trays()
-    score = 0
-    faulting_plant = None
-    
-    cycle = 0
     game_start = True
     game_over = False
 
-    while True:
-        pygame.event.pump()
+    tick_seconds = 1 / TICK_RATE
+    lag = 0.0
+    previous = {}
 
-        if not game_over:
-            screen.fill(BACKGROUND)
-            
-        if game_start:
-            person.draw(screen)
-            belt.draw(screen)
-            watering_can.draw(screen)
-            show_game_start(screen)
+    painter = None
+    if threaded:
+        from concurrent.futures import ThreadPoolExecutor
+        painter = ThreadPoolExecutor(1)
+    painting = None
 
-        if game_start or game_over:
-            key = pygame.key.get_pressed()
-            if key[pygame.K_RETURN]:
-                if game_start:
-                    game_start = False
-                else:
-                    break
-        else:
-            person.update(plants, obstacles, watering_can)
-            [p.update(cycle, watering_can.subsprite) for p in plants]
+    if telemetry_path is not None:
+        profiler.start_telemetry(telemetry_path)
 
-            belt.update()
+    try:
+        while True:
+            for event in pygame.event.get(pygame.KEYDOWN):
+                if event.key == pygame.K_F3:
+                    profiler.toggle_overlay()
 
-            if cycle % 1000 == 0:
-                new_plant = belt.add_plant()
-                if new_plant is not None:
-                    plants.append(new_plant)
-            
-            floating_items = plants + [watering_can]
-            
-            front_items = []
-            back_items = []
-            for item in floating_items:
-                if item == person.subsprite:
-                    if person.facing == Sprite.SOUTH:
-                        front_items = [item] + front_items
-                    else:
-                        back_items.append(item)
-                elif item.get_rect().bottom < person.get_rect().bottom:
-                    back_items.append(item)
-                else:
-                    front_items.append(item)
+            if profiler.enabled:
+                profiler.begin_frame()
 
-            [item.draw(screen) for item in back_items]
-            person.draw(screen)
-            [item.draw(screen) for item in front_items]
+            if game_start or game_over:
+                if game_start:
+                    camera.follow(game.person)
+                    screen.fill(BACKGROUND)
+                    camera.draw(screen, game.get_draw_order(camera.rect))
+                    show_game_start(screen)
+
+                key = pygame.key.get_pressed()
+                if key[pygame.K_RETURN]:
+                    if game_start:
+                        game_start = False
+                        renderer.invalidate()
+                        lag = 0.0
+                    else:
+                        break
 
-            belt.draw(screen)
+                pygame.display.flip()
+                if profiler.enabled:
+                    profiler.mark('menu')
 
-            for p in plants:
-                if not p.alive:
-                    score = len([p for p in plants if not isinstance(p.holder, ConveyorBeltTray)])
-                    show_game_over(p, score, screen)
+                if startup is not None:
+                    startup.mark('first frame')
+                    if startup_report:
+                        print(startup.get_report())
+                    startup = None
+            else:
+                key = pygame.key.get_pressed()
+                if profiler.enabled:
+                    profiler.mark('input')
+
+                ticks = 0
+                while lag >= tick_seconds and game.faulting_plant is None:
+                    if ticks == MAX_TICKS_PER_FRAME:
+                        # Too far behind to catch up; slow down
+                        lag = 0.0
+                        break
+
+                    # Only the last tick of a frame is interpolated
+                    if lag < 2 * tick_seconds or ticks == MAX_TICKS_PER_FRAME - 1:
+                        previous = game.get_positions(camera.rect)
+                        if profiler.enabled:
+                            profiler.mark('interpolate')
+
+                    recorder.record(key)
+                    game.step(key)
+                    lag -= tick_seconds
+                    ticks += 1
+
+                if profiler.enabled:
+                    profiler.count('ticks', ticks)
+
+                faulting_plant = game.faulting_plant
+                shifts = {}
+                if faulting_plant is None:
+                    shifts = get_shifts(previous, lag / tick_seconds)
+                    camera.follow(game.person, shifts.get(game.person, (0, 0)))
+                else:
+                    # Once the game is over, show the plant that ended it
+                    camera.follow(faulting_plant)
+
+                overlays = [profiler] if profiler.overlay else []
+                frame = renderer.plan(screen.get_rect(),\
+                    game.get_draw_order(camera.rect), camera.offset,\
+                    overlays, shifts)
+                if profiler.enabled:
+                    profiler.mark('draw')
+                    profiler.count('dirty_rects', len(frame))
+
+                # Show the previous frame once it is painted
+                if painting is not None:
+                    pygame.display.update(painting.result())
+                    painting = None
+                    if profiler.enabled:
+                        profiler.mark('wait')
+
+                if faulting_plant is not None:
+                    renderer.paint(screen, frame)
+                    show_game_over(faulting_plant, game.get_score(), screen, camera)
                     game_over = True
-                    break
-            
-            cycle += 1
-
-        pygame.display.flip()
-
-        clock.tick(60)
+                    pygame.display.flip()
+                elif painter is not None:
+                    painting = painter.submit(renderer.paint, screen, frame)
+                else:
+                    pygame.display.update(renderer.paint(screen, frame))
+                if profiler.enabled:
+                    profiler.mark('display')
+
+            lag += clock.tick(MAX_FPS) / 1000
+            if profiler.enabled:
+                profiler.mark('idle')
+                profiler.end_frame()
+    finally:
+        if painter is not None:
+            painter.shutdown()
+        if record_path is not None:
+            recorder.save(record_path)
+        profiler.stop_telemetry()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Botanical Bonanza')
+    parser.add_argument('--headless', type=int, metavar='TICKS',
+        help='run the simulation for TICKS ticks without a window')
+    parser.add_argument('--fast-forward', action='store_true',
+        help='with --headless or --replay, skip over idle stretches')
+    parser.add_argument('--autopilot', action='store_true',
+        help='with --headless, let the autopilot play instead of pressing nothing')
+    parser.add_argument('--seed', type=int,
+        help='seed for the game\'s random number generator')
+    parser.add_argument('--record', metavar='PATH',
+        help='save the inputs of the game played to PATH')
+    parser.add_argument('--replay', metavar='PATH',
+        help='replay a recording without a window, at full speed')
+    parser.add_argument('--telemetry', metavar='PATH',
+        help='stream per-frame timings to PATH as JSON lines')
+    parser.add_argument('--world', type=parse_size, metavar='WIDTHxHEIGHT',
+        help='size of the world, scrolled through a {}x{} window'.format(\
+            WIDTH, HEIGHT))
+    parser.add_argument('--threaded', action='store_true',
+        help='paint each frame on a worker thread while simulating the next')
+    parser.add_argument('--max-fps', type=int, default=MAX_FPS,
+        help='cap on frames drawn per second, or 0 for none')
+    parser.add_argument('--load', metavar='PATH',
+        help='resume the game saved in the snapshot at PATH')
+    parser.add_argument('--save', metavar='PATH',
+        help='with --headless, save a snapshot of the game to PATH')
+    parser.add_argument('--startup-report', action='store_true',
+        help='print how long each phase of starting up took')
+    parser.add_argument('--max-plants', type=int,
+        help='live plants past which the oldest are retired; '
+            'with --load, replaces the number saved in the snapshot')
+    args = parser.parse_args()
+
+    if args.record is not None and args.load is not None:
+        parser.error('recordings always start from a new game, not --load')
+    # Replays never retire plants, so they would play out differently
+    if args.record is not None and args.max_plants is not None:
+        parser.error('recordings are replayed without --max-plants')
+    # Recordings keep the seed in 64 unsigned bits
+    if args.seed is not None and not 0 <= args.seed < 2 ** 64:
+        parser.error('--seed must be from 0 to 2**64 - 1')
+    # Belts are laid out in bands of one window each
+    if args.world is not None and\
+        (args.world[0] < WIDTH or args.world[1] < HEIGHT):
+        parser.error('--world must be at least {}x{}'.format(WIDTH, HEIGHT))
+
+    if args.world is not None:
+        WORLD_WIDTH, WORLD_HEIGHT = args.world
+    MAX_FPS = args.max_fps
+
+    if args.replay is not None:
+        print(get_summary(replay(args.replay, args.fast_forward)))
+    elif args.headless is not None:
+        game = load_snapshot(args.load) if args.load is not None\
+            else Game(args.seed, args.max_plants)
+        if args.max_plants is not None:
+            game.max_plants = args.max_plants
+        inputs = None
+        if args.autopilot:
+            # Kept apart from the game's RNG, as in sweep.py
+            inputs = autopilot_policy(game, random.Random(game.seed ^ 0x5EED))
+        run_headless(args.headless, inputs, game, args.fast_forward)
+        print(get_summary(game))
+        print('pools: {}'.format(get_pool_stats()))
+        if args.save is not None:
+            save_snapshot(game, args.save)
+    else:
+        main(args.seed, args.record, args.telemetry, args.load, args.threaded,\
+            args.startup_report, args.max_plants)
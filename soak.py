@@ -0,0 +1,139 @@
+'''
+Soak test of the game's memory use over long sessions.
+
+Plays headless games back to back for as long as
+asked, starting a new game whenever one ends, and
+samples memory with tracemalloc at a fixed interval.
+Games retire plants past --max-plants, so memory
+should level off rather than keep climbing.
+
+Usage:
+
+        python3 soak.py --hours 4 --output soak.csv
+        python3 soak.py --hours 0.1 --interval 10 --policy idle
+        python3 soak.py --hours 8 --policy autopilot --max-plants 8
+'''
+import os
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import argparse, csv, itertools, random, time, tracemalloc
+
+import main
+from sweep import POLICIES
+
+# Ticks simulated between looks at the clock
+CHUNK_TICKS = 1000
+DEFAULT_MAX_PLANTS = 50
+
+def new_game(seed, policy_name, max_plants):
+    '''
+    Game and its input stream, or None for the
+    idle policy
+    '''
+    game = main.Game(seed, max_plants)
+    policy = POLICIES[policy_name]
+    if policy is None:
+        return game, None
+
+    return game, policy(game, random.Random(seed ^ 0x5EED))
+
+def run_chunk(game, inputs, ticks):
+    if inputs is None:
+        main.run_headless(ticks, game=game, fast_forward=True)
+    else:
+        main.run_headless(ticks, itertools.islice(inputs, ticks), game)
+
+def get_sample(start, ticks, games, game):
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        'seconds': round(time.perf_counter() - start, 1),
+        'ticks': ticks,
+        'games': games,
+        'plants': len(game.plants),
+        'retired': game.archive['plants'],
+        'events': len(game.water_table.events),
+        'current_kib': round(current / 1024, 1),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+def print_sample(sample):
+    print('{seconds:>9.1f} s  {ticks:>11} ticks  {games:>6} games  '
+        '{plants:>5} plants  {retired:>6} retired  {events:>6} events  '
+        '{current_kib:>10.1f} KiB  peak {peak_kib:>10.1f} KiB'.format(**sample))
+
+def run_soak(seconds, interval, policy_name, max_plants, first_seed):
+    '''
+    Play games for the given number of seconds and
+    return a memory sample for every interval
+    '''
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        seed = first_seed
+        game, inputs = new_game(seed, policy_name, max_plants)
+        ticks = 0
+        games = 1
+
+        samples = [get_sample(start, ticks, games, game)]
+        print_sample(samples[-1])
+        next_sample = start + interval
+        end = start + seconds
+        while time.perf_counter() < end:
+            before = game.cycle
+            run_chunk(game, inputs, CHUNK_TICKS)
+            ticks += game.cycle - before
+
+            if game.faulting_plant is not None:
+                game.release()
+                seed += 1
+                game, inputs = new_game(seed, policy_name, max_plants)
+                games += 1
+
+            if time.perf_counter() >= next_sample:
+                samples.append(get_sample(start, ticks, games, game))
+                print_sample(samples[-1])
+                next_sample += interval
+
+        game.release()
+    finally:
+        tracemalloc.stop()
+
+    return samples
+
+def soak():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--hours', type=float, default=1.0,
+        help='how long to play for')
+    parser.add_argument('--interval', type=float, default=60.0,
+        help='seconds between memory samples')
+    parser.add_argument('--policy', default='random', choices=sorted(POLICIES),
+        help='policy to play with')
+    parser.add_argument('--max-plants', type=int, default=DEFAULT_MAX_PLANTS,
+        help='live plants past which the oldest are retired')
+    parser.add_argument('--seed', type=int, default=0,
+        help='seed of the first game')
+    parser.add_argument('--output', metavar='PATH',
+        help='also write the samples to PATH as CSV')
+    args = parser.parse_args()
+
+    samples = run_soak(args.hours * 3600, args.interval, args.policy,\
+        args.max_plants, args.seed)
+
+    # The first interval includes loading assets and
+    # filling caches, so measure growth after it
+    first = samples[min(1, len(samples) - 1)]
+    last = samples[-1]
+    print('grew {:+.1f} KiB over the last {} games'.format(\
+        last['current_kib'] - first['current_kib'],\
+        last['games'] - first['games']))
+    print('pools: {}'.format(main.get_pool_stats()))
+
+    if args.output is not None:
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(samples[0]))
+            writer.writeheader()
+            writer.writerows(samples)
+
+if __name__ == '__main__':
+    soak()
@@ -0,0 +1,226 @@
+'''
+Batch simulator for tuning the game's difficulty.
+
+Plays many headless games across a pool of worker
+processes, one per core by default, for every
+combination of the parameters given, and prints one
+table of survival time, score and cause of death per
+combination.
+
+Every combination is played on the same seeds, so
+differences between rows come from the parameters
+rather than from luck.
+
+Usage:
+
+        python3 sweep.py --games 200 --tray-speed 1 2
+        python3 sweep.py --policy idle random \\
+            --water-decay 4-8 2-6 --output sweep.csv
+        python3 sweep.py --policy autopilot --games 20
+'''
+import os
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import argparse, csv, itertools, multiprocessing, random, statistics, sys
+
+import pygame
+
+import main
+
+# Key states the random policy picks from
+RANDOM_KEYS = (
+    (pygame.K_LEFT,),
+    (pygame.K_RIGHT,),
+    (pygame.K_UP,),
+    (pygame.K_DOWN,),
+    (pygame.K_SPACE,),
+    (pygame.K_LSHIFT,),
+    (pygame.K_LEFT, pygame.K_LSHIFT),
+    (pygame.K_RIGHT, pygame.K_LSHIFT),
+    (pygame.K_UP, pygame.K_LSHIFT),
+    (pygame.K_DOWN, pygame.K_LSHIFT),
+    (),
+)
+
+def random_policy(game, rng):
+    '''
+    Hold a random key combination for a random
+    number of ticks, forever
+    '''
+    keys = [main.KeyState(k) for k in RANDOM_KEYS]
+    while True:
+        key = rng.choice(keys)
+        for _ in range(rng.randint(1, 30)):
+            yield key
+
+# Policies by name. A policy takes the game and an RNG
+# and yields a key state per tick; None leaves every
+# key up, which lets idle stretches be fast-forwarded.
+POLICIES = {
+    'idle': None,
+    'random': random_policy,
+    'autopilot': main.autopilot_policy,
+}
+
+# Module globals of the game a sweep can vary
+PARAMETERS = (
+    'TRAY_SPEED',
+    'SPAWN_INTERVAL',
+    'MAX_CYCLES_WITHOUT_WATER',
+    'WATER_DECAY_RANGE',
+)
+
+def get_cause_name(plant):
+    if plant is None:
+        return 'survived'
+    elif plant.overwatered:
+        return 'overwatered'
+    elif plant.underwatered:
+        return 'underwatered'
+
+    return 'unknown'
+
+def run_game(task):
+    '''
+    Play one game in a worker process and return
+    (task, survival ticks, score, cause)
+    '''
+    params, policy_name, seed, ticks = task
+    for name, value in params:
+        setattr(main, name, value)
+
+    game = main.Game(seed)
+    policy = POLICIES[policy_name]
+    if policy is None:
+        main.run_headless(ticks, game=game, fast_forward=True)
+    else:
+        # Kept apart from the game's RNG, so the policy
+        # does not change how plants are rolled
+        inputs = policy(game, random.Random(seed ^ 0x5EED))
+        main.run_headless(ticks, inputs, game)
+
+    result = (task, game.cycle, game.get_score(),\
+        get_cause_name(game.faulting_plant))
+    game.release()
+    return result
+
+def get_tasks(grid, policies, games, ticks, first_seed):
+    '''
+    One task per game: every policy and parameter
+    combination, each played on the same seeds
+    '''
+    names = [name for name, _ in grid]
+    for values in itertools.product(*[values for _, values in grid]):
+        params = tuple(zip(names, values))
+        for policy in policies:
+            for seed in range(first_seed, first_seed + games):
+                yield (params, policy, seed, ticks)
+
+def aggregate(results):
+    '''
+    Group game results by policy and parameters into
+    rows of the result table
+    '''
+    groups = {}
+    for (params, policy, _, ticks), survival, score, cause in results:
+        groups.setdefault((policy, params, ticks), []).append((survival, score, cause))
+
+    rows = []
+    for (policy, params, ticks), games in sorted(groups.items()):
+        survivals = [g[0] for g in games]
+        scores = [g[1] for g in games]
+        causes = [g[2] for g in games]
+        row = {'policy': policy}
+        row.update((name.lower(), format_value(value)) for name, value in params)
+        row.update({
+            'games': len(games),
+            'mean_survival': statistics.mean(survivals),
+            'median_survival': statistics.median(survivals),
+            'survived': causes.count('survived') / len(games),
+            'mean_score': statistics.mean(scores),
+            'max_score': max(scores),
+            'underwatered': causes.count('underwatered'),
+            'overwatered': causes.count('overwatered'),
+        })
+        rows.append(row)
+
+    return rows
+
+def format_value(value):
+    if isinstance(value, tuple):
+        return '-'.join(str(v) for v in value)
+
+    return value
+
+def print_table(rows):
+    columns = list(rows[0])
+    cells = [[format_cell(row[c]) for c in columns] for row in rows]
+    widths = [max(len(c), *(len(r[i]) for r in cells)) for i, c in enumerate(columns)]
+    print('  '.join(c.rjust(w) for c, w in zip(columns, widths)))
+    for r in cells:
+        print('  '.join(v.rjust(w) for v, w in zip(r, widths)))
+
+def format_cell(value):
+    if isinstance(value, float):
+        return '{:.2f}'.format(value)
+
+    return str(value)
+
+def parse_range(text):
+    '''
+    Parse a range given as LOW-HIGH
+    '''
+    low, high = text.split('-')
+    return int(low), int(high)
+
+def sweep():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--games', type=int, default=100,
+        help='games per combination')
+    parser.add_argument('--ticks', type=int, default=50000,
+        help='longest a game is played for')
+    parser.add_argument('--seed', type=int, default=0,
+        help='seed of the first game of each combination')
+    parser.add_argument('--policy', nargs='+', default=['random'],
+        choices=sorted(POLICIES), help='policies to play with')
+    parser.add_argument('--tray-speed', type=int, nargs='+',
+        default=[main.TRAY_SPEED])
+    parser.add_argument('--spawn-interval', type=int, nargs='+',
+        default=[main.SPAWN_INTERVAL])
+    parser.add_argument('--max-cycles-without-water', type=int, nargs='+',
+        default=[main.MAX_CYCLES_WITHOUT_WATER])
+    parser.add_argument('--water-decay', type=parse_range, nargs='+',
+        default=[main.WATER_DECAY_RANGE], metavar='LOW-HIGH',
+        help='water lost per cycle, in thousandths')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(),
+        help='worker processes (default: one per core)')
+    parser.add_argument('--output', metavar='PATH',
+        help='also write the table to PATH as CSV')
+    args = parser.parse_args()
+
+    grid = list(zip(PARAMETERS, (args.tray_speed, args.spawn_interval,\
+        args.max_cycles_without_water, args.water_decay)))
+    tasks = list(get_tasks(grid, args.policy, args.games, args.ticks, args.seed))
+
+    results = []
+    with multiprocessing.Pool(args.processes) as pool:
+        chunksize = max(1, len(tasks) // (4 * args.processes))
+        for result in pool.imap_unordered(run_game, tasks, chunksize):
+            results.append(result)
+            print('\r{}/{} games'.format(len(results), len(tasks)),\
+                end='', file=sys.stderr)
+
+    print(file=sys.stderr)
+
+    rows = aggregate(results)
+    print_table(rows)
+
+    if args.output is not None:
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+if __name__ == '__main__':
+    sweep()
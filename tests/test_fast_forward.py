@@ -0,0 +1,100 @@
+'''
+Fast-forwarding an idle game must end it the way
+stepping through it one tick at a time does.
+
+Usage:
+
+        python3 -m unittest discover tests
+'''
+import os, sys, unittest, warnings
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy
+
+import main
+
+TICKS = 20000
+SEEDS = range(4)
+
+def play(seed, fast_forward, prepare=None):
+    '''
+    Idle game played for TICKS ticks, after
+    prepare(game) is given the first tick
+    '''
+    game = main.Game(seed)
+    game.step(main.NO_KEYS)
+    if prepare is not None:
+        prepare(game)
+
+    main.run_headless(TICKS, game=game, fast_forward=fast_forward)
+    return game
+
+class FastForwardTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        os.chdir(ROOT)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+
+    def assertSameOutcome(self, stepped, skipped):
+        self.assertEqual(stepped.cycle, skipped.cycle)
+        self.assertEqual(stepped.get_score(), skipped.get_score())
+        self.assertEqual(len(stepped.plants), len(skipped.plants))
+        if stepped.faulting_plant is None:
+            self.assertIsNone(skipped.faulting_plant)
+        else:
+            self.assertEqual(stepped.plants.index(stepped.faulting_plant),\
+                skipped.plants.index(skipped.faulting_plant))
+            self.assertEqual(main.get_cause(stepped.faulting_plant),\
+                main.get_cause(skipped.faulting_plant))
+
+        n = stepped.water_table.size
+        for name in ('water_level', 'overwater_amount'):
+            stepped_column = getattr(stepped.water_table, name)[:n]
+            skipped_column = getattr(skipped.water_table, name)[:n]
+            self.assertTrue(numpy.isfinite(skipped_column).all(), name)
+            numpy.testing.assert_allclose(skipped_column, stepped_column,\
+                atol=1e-6, err_msg=name)
+        for name in ('cycles_without_water', 'alive', 'underwatered', 'overwatered'):
+            numpy.testing.assert_array_equal(\
+                getattr(skipped.water_table, name)[:n],\
+                getattr(stepped.water_table, name)[:n], err_msg=name)
+
+        stepped.release()
+        skipped.release()
+
+    def check(self, prepare=None):
+        for seed in SEEDS:
+            with self.subTest(seed=seed):
+                self.assertSameOutcome(play(seed, False, prepare),\
+                    play(seed, True, prepare))
+
+    def test_idle(self):
+        self.check()
+
+    def test_overwatered(self):
+        def overwater(game):
+            table = game.water_table
+            table.water_level[:table.size] = table.max_water_level[:table.size] + 3
+            table.reschedule()
+
+        self.check(overwater)
+
+    def test_no_decay(self):
+        decay_range = main.WATER_DECAY_RANGE
+        main.WATER_DECAY_RANGE = (0, 2)
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                self.check()
+        finally:
+            main.WATER_DECAY_RANGE = decay_range
+
+if __name__ == '__main__':
+    unittest.main()